@@ -1,12 +1,13 @@
+import numpy as np
 import pandas as pd
-from typing import Dict, Tuple, Optional
-from conf import VIBRATION_VARS, PHYSICAL_VARS, CATEGORICAL_VARS, ACCUMULATIVE_VARS,CATEGORICAL_DOMAINS
+from typing import Tuple
+from conf import VIBRATION_VARS, PHYSICAL_VARS, CATEGORICAL_VARS, ACCUMULATIVE_VARS
+from conf import VIBRATION_SET, ACCUMULATIVE_SET, NUMERIC_VARS, CATEGORICAL_DOMAINS_INT
 
 
-# phase2_flags.py
-
-import pandas as pd
-from typing import List
+# =====================================================
+#  Flags severas -> NaN (fase 2)
+# =====================================================
 
 FLAG_AS_MISSING_COLS = [
     "is_invalid_physical",
@@ -26,12 +27,16 @@ def aplicar_flags_a_nan(df_limpio: pd.DataFrame) -> pd.DataFrame:
     if "valor" not in df.columns:
         raise ValueError("Falta la columna 'valor' en df_limpio.")
 
-    mask_severa = False
-    for col in FLAG_AS_MISSING_COLS:
-        if col in df.columns:
-            mask_severa = mask_severa | df[col].astype(bool)
-
-    df.loc[mask_severa, "valor"] = pd.NA
+    # OR de todas las flags severas en una sola pasada
+    # (mismas reglas que astype(bool): una flag NaN cuenta como activa)
+    arrs = [
+        df[col].to_numpy().astype(bool)
+        for col in FLAG_AS_MISSING_COLS
+        if col in df.columns
+    ]
+    if arrs:
+        mask_severa = np.logical_or.reduce(arrs)
+        df.loc[mask_severa, "valor"] = pd.NA
 
     return df
 
@@ -64,12 +69,14 @@ def compute_vibration_stats(df: pd.DataFrame) -> pd.DataFrame:
     Calcula estadísticos descriptivos e IQR para variables de vibración.
 
     - Aplica solo a VIBRATION_VARS.
+    - Usa la columna valor_num (valor ya convertido a numérico) si existe;
+      si no, convierte valor.
     - Devuelve, por variable:
         count, mean, std, min, q1, q3, iqr, max
     """
-    df_vib = df[df["variable"].isin(VIBRATION_VARS)].copy()
-    df_vib["valor"] = pd.to_numeric(df_vib["valor"], errors="coerce")
-    df_vib = df_vib.dropna(subset=["valor"])
+    mask_vib = df["variable"].isin(VIBRATION_SET)
+    df_vib = df.loc[mask_vib, ["variable"]].assign(valor_num=_valor_num(df)[mask_vib])
+    df_vib = df_vib.dropna(subset=["valor_num"])
 
     if df_vib.empty:
         return pd.DataFrame(columns=[
@@ -77,57 +84,120 @@ def compute_vibration_stats(df: pd.DataFrame) -> pd.DataFrame:
             "min", "q1", "q3", "iqr", "max"
         ])
 
+    grouped = df_vib.groupby("variable", observed=True)["valor_num"]
+
     # Estadísticos básicos
-    stats = df_vib.groupby("variable")["valor"].agg(
+    stats = grouped.agg(
         count="count",
         mean="mean",
         min="min",
         max="max",
     )
 
-    # Cuartiles e IQR
-    q1 = df_vib.groupby("variable")["valor"].quantile(0.25)
-    q3 = df_vib.groupby("variable")["valor"].quantile(0.75)
-    iqr = q3 - q1
+    # Cuartiles (ambos en una sola pasada) e IQR
+    quartiles = grouped.quantile([0.25, 0.75]).unstack()
 
-    stats["q1"] = q1
-    stats["q3"] = q3
-    stats["iqr"] = iqr
+    stats["q1"] = quartiles[0.25]
+    stats["q3"] = quartiles[0.75]
+    stats["iqr"] = stats["q3"] - stats["q1"]
 
     stats = stats[["count", "mean", "min","max", "q1", "q3", "iqr"]]
-    return stats.reset_index()
+
+    # Índice como texto plano y en orden alfabético (variable puede ser Categorical)
+    stats.index = stats.index.astype(str)
+    return stats.sort_index().reset_index()
 
 
 # =====================================================
 # 4) Marcación de anomalías por grupo
 # =====================================================
 
-def mark_missing(df: pd.DataFrame) -> pd.DataFrame:
-    df_out = df.copy()
-    df_out["is_missing"] = df_out["valor"].isna()
+# Las funciones mark_* devuelven el DF con su flag. Por defecto trabajan sobre
+# una copia (como siempre); con copy=False marcan df in situ y lo devuelven
+# (así las usa limpiar_por_variable, sobre su única copia).
+# Si df trae la columna valor_num (valor convertido a numérico una sola vez en
+# limpiar_por_variable) la reutilizan; si no, convierten valor.
+# Cada una calcula una máscara numpy bool de longitud completa y asigna su
+# columna de flag de una vez (sin escrituras .loc dispersas que suben el dtype).
+
+CLEANING_FLAG_COLS = [
+    "is_missing",
+    "is_invalid_physical",
+    "is_high",
+    "is_outlier",
+    "is_invalid_category",
+    "is_invalid_monotonic",
+]
+
+
+def _variable_dtype(variable: pd.Series) -> pd.CategoricalDtype:
+    """
+    Categorías = variables conocidas de conf + cualquier otra presente en los datos
+    (para no perder variables 'unknown' al convertir).
+    """
+    known = VIBRATION_VARS + PHYSICAL_VARS + CATEGORICAL_VARS + ACCUMULATIVE_VARS
+    extra = [v for v in variable.dropna().unique() if v not in known]
+    return pd.CategoricalDtype(categories=known + extra)
+
+
+def _valor_num(df: pd.DataFrame) -> pd.Series:
+    """
+    valor como numérico: la columna valor_num si ya existe; si no, se
+    convierte valor (los no numéricos quedan como NaN).
+    """
+    if "valor_num" in df.columns:
+        return df["valor_num"]
+    return pd.to_numeric(df["valor"], errors="coerce")
+
+
+def _init_flags(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Crea todas las columnas de flags de limpieza en False (dtype bool).
+    """
+    n = len(df)
+    for col in CLEANING_FLAG_COLS:
+        df[col] = np.zeros(n, dtype=bool)
+    return df
+
+
+def mark_missing(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
+    df_out = df.copy() if copy else df
+    df_out["is_missing"] = df_out["valor"].isna().to_numpy(dtype=bool)
     return df_out
 
 
-def mark_invalid_physical(df: pd.DataFrame) -> pd.DataFrame:
+def mark_invalid_physical(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """
     Marca valores físicamente imposibles:
       - cualquier valor numérico < 0 en continuas o acumulativas
     """
-    df_out = df.copy()
-    df_out["is_invalid_physical"] = False
-
-    mask_num = df_out["variable"].isin(VIBRATION_VARS + PHYSICAL_VARS + ACCUMULATIVE_VARS)
-    df_num = df_out[mask_num].copy()
+    df_out = df.copy() if copy else df
 
-    df_num["valor"] = pd.to_numeric(df_num["valor"], errors="coerce")
+    mask_num = df_out["variable"].isin(NUMERIC_VARS).to_numpy()
+    valor = _valor_num(df_out).to_numpy(dtype=float)
 
-    invalid_idx = df_num.index[df_num["valor"] < 0]
-    df_out.loc[invalid_idx, "is_invalid_physical"] = True
+    # NaN < 0 es False: los faltantes no se marcan aquí
+    df_out["is_invalid_physical"] = mask_num & (valor < 0)
 
     return df_out
 
 
-def mark_vibration_outliers(df: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFrame:
+def _lookup_por_variable(variable: pd.Series, tabla: pd.DataFrame) -> np.ndarray:
+    """
+    Alinea fila a fila una tabla indexada por variable (NaN si no está).
+    Con "variable" Categorical se indexa por códigos enteros (un gather por
+    fila); si no, se usa reindex sobre los valores.
+    """
+    if isinstance(variable.dtype, pd.CategoricalDtype):
+        por_categoria = tabla.reindex(variable.cat.categories).to_numpy(dtype=float)
+        # Fila extra de NaN para el código -1 (variable nula)
+        por_categoria = np.vstack([por_categoria, np.full((1, tabla.shape[1]), np.nan)])
+        return por_categoria[variable.cat.codes.to_numpy()]
+
+    return tabla.reindex(variable.to_numpy()).to_numpy(dtype=float)
+
+
+def _vibration_outlier_masks(df: pd.DataFrame, stats: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
     """
     Marca valores altos y extremos en variables de vibración usando IQR.
 
@@ -142,138 +212,120 @@ def mark_vibration_outliers(df: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFra
     NOTA:
       - is_outlier tiene prioridad: si es outlier, no se marca como high.
       - Si IQR <= 0 o faltan Q1/Q3, no se marcan flags para esa variable.
-    """
-    df_out = df.copy()
-    df_out["is_high"] = False
-    df_out["is_outlier"] = False
 
+    Solo lee df: devuelve (is_high, is_outlier) como arrays bool de longitud completa.
+    """
     if stats.empty:
-        return df_out
+        return np.zeros(len(df), dtype=bool), np.zeros(len(df), dtype=bool)
 
-    # Mapas por variable
-    q1_map: Dict[str, float] = dict(zip(stats["variable"], stats["q1"]))
-    q3_map: Dict[str, float] = dict(zip(stats["variable"], stats["q3"]))
-    iqr_map: Dict[str, float] = dict(zip(stats["variable"], stats["iqr"]))
+    # Solo variables de vibración
+    mask_vib = df["variable"].isin(VIBRATION_SET).to_numpy()
 
-    # Filtramos solo variables de vibración
-    mask_vib = df_out["variable"].isin(VIBRATION_VARS)
-    df_vib = df_out[mask_vib].copy()
-    df_vib["valor"] = pd.to_numeric(df_vib["valor"], errors="coerce")
+    # Umbrales alineados fila a fila (NaN si la variable no tiene stats)
+    umbrales = _lookup_por_variable(df["variable"], stats.set_index("variable")[["q1", "q3", "iqr"]])
+    q1, q3, iqr = umbrales[:, 0], umbrales[:, 1], umbrales[:, 2]
+    val = _valor_num(df).to_numpy(dtype=float)
 
-    def _flags(row):
-        var = row["variable"]
-        val = row["valor"]
+    # Si falta algo o IQR no es positivo, no marcamos
+    valid = mask_vib & np.isfinite(val) & (iqr > 0)
 
-        if pd.isna(val):
-            return False, False
+    # Outlier extremo
+    is_out = valid & ((val < q1 - 3.0 * iqr) | (val > q3 + 3.0 * iqr))
 
-        q1 = q1_map.get(var)
-        q3 = q3_map.get(var)
-        iqr = iqr_map.get(var)
+    # Zona alta (solo si no es extremo)
+    is_high = valid & ~is_out & ((val < q1 - 1.5 * iqr) | (val > q3 + 1.5 * iqr))
 
-        # Si falta algo o IQR no es positivo, no marcamos
-        if q1 is None or q3 is None or iqr is None or iqr <= 0:
-            return False, False
+    return is_high, is_out
 
-        # Umbrales
-        low_high = q1 - 1.5 * iqr
-        high_high = q3 + 1.5 * iqr
 
-        low_out = q1 - 3.0 * iqr
-        high_out = q3 + 3.0 * iqr
+def mark_vibration_outliers(df: pd.DataFrame, stats: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
+    """
+    Marca valores altos (is_high) y extremos (is_outlier) en vibración.
+    Ver _vibration_outlier_masks para el criterio IQR.
+    """
+    df_out = df.copy() if copy else df
+    df_out["is_high"], df_out["is_outlier"] = _vibration_outlier_masks(df_out, stats)
+    return df_out
 
-        # Outlier extremo
-        is_out = (val < low_out) or (val > high_out)
 
-        # Zona alta (solo si no es extremo)
-        is_high = False
-        if not is_out and (val < low_high or val > high_high):
-            is_high = True
+def _categorical_invalid_mask(df: pd.DataFrame) -> np.ndarray:
+    """
+    Máscara de valores categóricos fuera de dominio (solo lee df).
+    Maneja correctamente valores como 0, 1, 0.0, 1.0, "1", "1.0", etc.
+    """
+    # valor_num ya acepta "1", "1.0", 1, 1.0, etc.
+    val = _valor_num(df).to_numpy(dtype=float)
+
+    # Missing se trata aparte, no como inválido de dominio.
+    # np.trunc reproduce int(): 1.7 -> 1 (inf queda fuera de dominio)
+    val_int = np.trunc(val)
+    notna = ~np.isnan(val)
+
+    is_bad = np.zeros(len(df), dtype=bool)
+    for var in CATEGORICAL_VARS:
+        valid_vals = CATEGORICAL_DOMAINS_INT.get(var)
+        if valid_vals is None:
+            continue
 
-        return is_high, is_out
+        mask_var = (df["variable"] == var).to_numpy(dtype=bool)
+        if not mask_var.any():
+            continue
 
-    flags = df_vib.apply(_flags, axis=1, result_type="expand")
-    flags.columns = ["is_high_tmp", "is_outlier_tmp"]
+        is_bad |= mask_var & notna & ~np.isin(val_int, list(valid_vals))
 
-    df_out.loc[mask_vib, "is_high"] = flags["is_high_tmp"].values
-    df_out.loc[mask_vib, "is_outlier"] = flags["is_outlier_tmp"].values
+    return is_bad
 
-    return df_out
 
-def mark_categorical_invalid(df: pd.DataFrame) -> pd.DataFrame:
+def mark_categorical_invalid(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """
     Marca valores categóricos fuera de dominio.
-    Maneja correctamente valores como 0, 1, 0.0, 1.0, "1", "1.0", etc.
     """
-    df_out = df.copy()
-    df_out["is_invalid_category"] = False
-
-    mask_cat = df_out["variable"].isin(CATEGORICAL_VARS)
-    df_cat = df_out[mask_cat].copy()
+    df_out = df.copy() if copy else df
+    df_out["is_invalid_category"] = _categorical_invalid_mask(df_out)
+    return df_out
 
-    if df_cat.empty:
-        return df_out
 
-    # Convertimos a numérico una sola vez (acepta "1", "1.0", 1, 1.0, etc.)
-    df_cat["valor_num"] = pd.to_numeric(df_cat["valor"], errors="coerce")
+def _accumulative_integrity_mask(df: pd.DataFrame) -> np.ndarray:
+    """
+    Máscara de contadores que decrecen respecto a la lectura anterior
+    de la misma variable (solo lee df).
+    """
+    is_bad = np.zeros(len(df), dtype=bool)
 
-    for var, group in df_cat.groupby("variable"):
-        raw_domain = CATEGORICAL_DOMAINS.get(var)
-        if raw_domain is None:
-            continue
+    mask_acc = df["variable"].isin(ACCUMULATIVE_SET).to_numpy()
+    if not mask_acc.any():
+        return is_bad
 
-        # Normalizamos el dominio a enteros (por si vienen como strings)
-        valid_vals = {int(v) for v in raw_domain}
+    pos = np.flatnonzero(mask_acc)
+    codes, _ = pd.factorize(df["variable"].to_numpy()[pos])
+    vals = _valor_num(df).to_numpy(dtype=float)[pos]
 
-        for idx, row in group.iterrows():
-            val_num = row["valor_num"]
-            if pd.isna(val_num):
-                # Missing se trata aparte, no como inválido de dominio
-                continue
-            try:
-                val_int = int(val_num)
-            except Exception:
-                df_out.at[idx, "is_invalid_category"] = True
-                continue
+    # Orden (variable, ts_utc) estable; NaT al final como en sort_values
+    ts = df["ts_utc"].to_numpy(dtype="datetime64[ns]")[pos].view("i8").copy()
+    ts[ts == np.iinfo(np.int64).min] = np.iinfo(np.int64).max
+    if (ts[1:] >= ts[:-1]).all():
+        # Ya viene en orden temporal: basta agrupar por variable (estable)
+        order = np.argsort(codes, kind="stable")
+    else:
+        order = np.lexsort((ts, codes))
+    codes, vals, pos = codes[order], vals[order], pos[order]
 
-            if val_int not in valid_vals:
-                df_out.at[idx, "is_invalid_category"] = True
+    # Una sola pasada: comparamos con la fila anterior de la misma variable
+    # (un NaN corta la comparación, igual que groupby().shift(1))
+    bad = (codes[1:] == codes[:-1]) & (vals[1:] < vals[:-1])
 
-    return df_out
+    is_bad[pos[1:][bad]] = True
 
+    return is_bad
 
 
-def mark_accumulative_integrity(df: pd.DataFrame) -> pd.DataFrame:
+def mark_accumulative_integrity(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """
     Verifica integridad de contadores:
       - no deben decrecer a lo largo del tiempo dentro del despliegue.
-    Requiere:
-      - df ordenado por ts_utc
     """
-    df_out = df.copy()
-    df_out["is_invalid_monotonic"] = False
-
-    mask_acc = df_out["variable"].isin(ACCUMULATIVE_VARS)
-    df_acc = df_out[mask_acc].copy()
-
-    if df_acc.empty:
-        return df_out
-
-    # Aseguramos orden temporal
-    df_acc = df_acc.sort_values(["variable", "ts_utc"])
-    df_acc["valor"] = pd.to_numeric(df_acc["valor"], errors="coerce")
-
-    for var, group in df_acc.groupby("variable"):
-        prev_val: Optional[float] = None
-        for idx, row in group.iterrows():
-            val = row["valor"]
-            if pd.isna(val):
-                prev_val = val
-                continue
-            if prev_val is not None and not pd.isna(prev_val) and val < prev_val:
-                df_out.at[idx, "is_invalid_monotonic"] = True
-            prev_val = val
-
+    df_out = df.copy() if copy else df
+    df_out["is_invalid_monotonic"] = _accumulative_integrity_mask(df_out)
     return df_out
 
 
@@ -281,33 +333,37 @@ def mark_accumulative_integrity(df: pd.DataFrame) -> pd.DataFrame:
 # 5) Indicador de calidad (quality_code)
 # =====================================================
 
-def compute_quality_code(row: pd.Series) -> int:
+# Bit i del empaquetado -> código de calidad i + 1 (de menos a más severo)
+QUALITY_FLAG_BITS = [
+    "is_missing",            # bit 0 -> 1: Valor faltante
+    "is_gap",                # bit 1 -> 2: Gap temporal
+    "is_outlier",            # bit 2 -> 3: Valor extremo
+    "is_invalid_category",   # bit 3 -> 4: Categoría inválida
+    "is_invalid_physical",   # bit 4 -> 5: Valor físicamente imposible
+    "is_invalid_monotonic",  # bit 5 -> 6: Error de integridad en contador
+]
+
+# Tabla de severidad (256 entradas): el bit activo más alto gana (0: OK)
+SEVERITY_TABLE = np.array([b.bit_length() for b in range(256)], dtype=np.int8)
+
+
+def compute_quality_code(df: pd.DataFrame) -> np.ndarray:
     """
     Aplica la jerarquía de severidad para asignar un código de calidad
     compatible con iot.indicador_calidad.
+
+    Vectorizado sobre todo el DataFrame: empaqueta los flags en un uint8
+    (ver QUALITY_FLAG_BITS) y resuelve el código con una consulta a
+    SEVERITY_TABLE. Devuelve un array int8 con un código por fila.
     """
-    # Por si acaso no existen todas las columnas (se usan get)
-    invalid_monotonic = bool(row.get("is_invalid_monotonic", False))
-    invalid_physical = bool(row.get("is_invalid_physical", False))
-    invalid_category = bool(row.get("is_invalid_category", False))
-    is_outlier = bool(row.get("is_outlier", False))
-    is_gap = bool(row.get("is_gap", False))  # viene de módulo temporal
-    is_missing = bool(row.get("is_missing", False))
-
-    # Jerarquía de más severo a menos severo
-    if invalid_monotonic:
-        return 6  # Error de integridad en contador
-    if invalid_physical:
-        return 5  # Valor físicamente imposible
-    if invalid_category:
-        return 4  # Categoría inválida
-    if is_outlier:
-        return 3  # Valor extremo (>p99)
-    if is_gap:
-        return 2  # Gap temporal
-    if is_missing:
-        return 1  # Valor faltante
-    return 0      # OK
+    bits = np.zeros(len(df), dtype=np.uint8)
+    for bit, col in enumerate(QUALITY_FLAG_BITS):
+        # Por si acaso no existen todas las columnas (is_gap viene de módulo temporal)
+        # (mismas reglas que bool(): una flag NaN cuenta como activa)
+        if col in df.columns:
+            bits |= df[col].to_numpy().astype(bool).astype(np.uint8) << np.uint8(bit)
+
+    return SEVERITY_TABLE[bits]
 
 
 # =====================================================
@@ -336,45 +392,49 @@ def limpiar_por_variable(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
 
     Salida:
       - df_limpio: DataFrame con banderas + quality_code
-      - stats_vib: tabla de estadísticos p50/p95/p99 para variables de vibración
+      - stats_vib: tabla de estadísticos e IQR (q1/q3) para variables de vibración
     """
-    df_proc = df.copy()
+    # Única copia del pipeline: los mark_* trabajan in situ sobre df_proc.
+    # Aseguramos orden temporal (para acumulativas); sort_values ya devuelve copia.
+    # Si ya viene ordenado (lo habitual tras preparar_estructura_temporal),
+    # basta con una copia.
+    if "ts_utc" in df.columns and not df["ts_utc"].is_monotonic_increasing:
+        df_proc = df.sort_values("ts_utc", kind="stable")
+    else:
+        df_proc = df.copy()
+
+    # Flags en False (bool) de una sola vez
+    df_proc = _init_flags(df_proc)
 
-    # Aseguramos orden temporal (para acumulativas)
-    if "ts_utc" in df_proc.columns:
-        df_proc = df_proc.sort_values("ts_utc")
+    # Conversión numérica única, compartida por todos los mark_*
+    df_proc["valor_num"] = pd.to_numeric(df_proc["valor"], errors="coerce")
+
+    # "variable" como Categorical: los isin/groupby trabajan sobre códigos enteros
+    var_dtype = df_proc["variable"].dtype
+    df_proc["variable"] = df_proc["variable"].astype(_variable_dtype(df_proc["variable"]))
 
     # 1) Missing
-    df_proc = mark_missing(df_proc)
+    mark_missing(df_proc, copy=False)
 
     # 2) Valores físicamente imposibles
-    df_proc = mark_invalid_physical(df_proc)
+    mark_invalid_physical(df_proc, copy=False)
 
     # 3) Estadísticos para vibración
     stats_vib = compute_vibration_stats(df_proc)
 
     # 4) Outliers y valores altos en vibración
-    df_proc = mark_vibration_outliers(df_proc, stats_vib)
+    mark_vibration_outliers(df_proc, stats_vib, copy=False)
 
     # 5) Categóricas fuera de dominio
-    df_proc = mark_categorical_invalid(df_proc)
+    mark_categorical_invalid(df_proc, copy=False)
 
     # 6) Integridad de contadores
-    df_proc = mark_accumulative_integrity(df_proc)
-
-    # Aseguramos que columnas de flags existan (por si algún grupo no aplicó)
-    for col in [
-        "is_missing",
-        "is_invalid_physical",
-        "is_high",
-        "is_outlier",
-        "is_invalid_category",
-        "is_invalid_monotonic",
-    ]:
-        if col not in df_proc.columns:
-            df_proc[col] = False
+    mark_accumulative_integrity(df_proc, copy=False)
 
     # 7) Quality code
-    df_proc["quality_code"] = df_proc.apply(compute_quality_code, axis=1)
+    df_proc["quality_code"] = compute_quality_code(df_proc)
+
+    del df_proc["valor_num"]
+    df_proc["variable"] = df_proc["variable"].astype(var_dtype)
 
     return df_proc, stats_vib
@@ -78,6 +78,15 @@ ACCUMULATIVE_VARS = [
     "Total Running Time",
 ]
 
+# Versiones frozenset (precalculadas una vez) para isin / pertenencia O(1)
+VIBRATION_SET = frozenset(VIBRATION_VARS)
+PHYSICAL_SET = frozenset(PHYSICAL_VARS)
+CATEGORICAL_SET = frozenset(CATEGORICAL_VARS)
+ACCUMULATIVE_SET = frozenset(ACCUMULATIVE_VARS)
+
+# Variables numéricas continuas + acumulativas (no admiten valores < 0)
+NUMERIC_VARS = VIBRATION_SET | PHYSICAL_SET | ACCUMULATIVE_SET
+
 
 # =====================================================
 # 2) Dominios categóricos empíricos
@@ -91,6 +100,12 @@ CATEGORICAL_DOMAINS = {
     "Number of Starts Between Measurements": {0, 1,2},
 }
 
+# Dominios normalizados a enteros una sola vez (por si vienen como strings)
+CATEGORICAL_DOMAINS_INT = {
+    var: frozenset(int(v) for v in dominio)
+    for var, dominio in CATEGORICAL_DOMAINS.items()
+}
+
 QUALITY_CODES = {
         0: "OK",
         1: "Valor faltante",
@@ -2,7 +2,7 @@ import pandas as pd
 import datetime as dt
 
 from config_api import (
-    session, headers, auth,
+    session, headers, auth, json_loads,
     BASE_DESPLIEGUES, BASE_ASSETS, BASE_MOTORES, BASE_INGESTAS
 )
 
@@ -88,13 +88,24 @@ def load_via_by_asset_motor(
         print("Error al traer ingestas:", r.status_code, r.text)
         r.raise_for_status()
 
-    payload = r.json()
-    df = pd.DataFrame(payload.get("items", []))
+    # Decodificamos directamente los bytes (orjson si está disponible)
+    payload = json_loads(r.content)
+    df = pd.DataFrame.from_records(payload.get("items", []))
 
+    # Formato ISO 8601 explícito: parser vectorizado en C (sin dateutil fila a fila)
     if "ts_utc" in df.columns:
-        df["ts_utc"] = pd.to_datetime(df["ts_utc"])
+        df["ts_utc"] = pd.to_datetime(df["ts_utc"], format="ISO8601", utc=True, cache=True)
     if "ts_local_tz" in df.columns:
-        df["ts_local_tz"] = pd.to_datetime(df["ts_local_tz"])
+        # Se conserva el offset local (sin utc=True)
+        df["ts_local_tz"] = pd.to_datetime(df["ts_local_tz"], format="ISO8601", cache=True)
+    # valor numérico (float64) desde la ingesta: evita columnas object con
+    # floats en caja; los pd.to_numeric posteriores pasan a ser no-ops.
+    if "valor" in df.columns:
+        df["valor"] = pd.to_numeric(df["valor"], errors="coerce").astype("float64")
+    # Claves de baja cardinalidad como category: dedup/groupby sobre códigos enteros
+    for col in ("asset_codigo", "motor_codigo", "variable"):
+        if col in df.columns:
+            df[col] = df[col].astype("category")
 
     return df
 
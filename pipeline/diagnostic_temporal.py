@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from typing import Tuple, Dict, List
 
@@ -33,12 +34,14 @@ def resolver_duplicados_muestras(
     if "ingesta_id" in df.columns:
         sort_cols.append("ingesta_id")
 
-    df_sorted = df.sort_values(sort_cols).reset_index(drop=True)
+    # ignore_index evita las dos copias extra de reset_index(drop=True)
+    df_sorted = df.sort_values(sort_cols, kind="stable", ignore_index=True)
 
     df_sin_dups = df_sorted.drop_duplicates(
         subset=key_cols,
-        keep=keep
-    ).reset_index(drop=True)
+        keep=keep,
+        ignore_index=True,
+    )
 
     return df_sin_dups
 
@@ -67,44 +70,50 @@ def preparar_estructura_temporal(
     # 1) Ordenar por ts_utc
     df_sorted = df.sort_values("ts_utc").reset_index(drop=True)
 
-    # 2) Timestamps únicos (a nivel de muestra, no por variable)
-    ts_unique = (
-        df_sorted["ts_utc"]
-        .drop_duplicates()
-        .sort_values()
-        .reset_index(drop=True)
-    )
+    # 2) Timestamps únicos (a nivel de muestra, no por variable).
+    # df_sorted ya está ordenado: basta comparar cada ts con el anterior
+    # (una pasada, sin hash ni segundo sort).
+    ts_all = df_sorted["ts_utc"].to_numpy(dtype="datetime64[ns]").view("i8")
+    es_nuevo = np.empty(len(ts_all), dtype=bool)
+    es_nuevo[:1] = True
+    es_nuevo[1:] = ts_all[1:] != ts_all[:-1]
+
+    ts_unique = df_sorted["ts_utc"][es_nuevo].reset_index(drop=True)
 
-    # 3) Calcular deltas en segundos
-    delta = ts_unique.diff().dt.total_seconds()
+    # 3) Calcular deltas en segundos directamente sobre los int64 (ns)
+    ts_ns = ts_all[es_nuevo]
+    es_nat = ts_unique.isna().to_numpy()
+
+    # El primer registro no tiene delta (es NaN); tampoco los que tocan un NaT
+    delta = np.full(len(ts_ns), np.nan)
+    delta[1:] = (ts_ns[1:] - ts_ns[:-1]) / 1e9
+    delta[1:][es_nat[1:] | es_nat[:-1]] = np.nan
 
     df_gaps = pd.DataFrame({
         "ts_utc": ts_unique,
         "delta_s": delta
     })
 
-    # El primer registro no tiene delta (es NaN)
-    df_gaps.loc[0, "delta_s"] = None
-
     # 4) Definir umbral de gap
     gap_threshold = expected_sec * gap_factor
-    df_gaps["is_gap"] = df_gaps["delta_s"] > gap_threshold
+    df_gaps["is_gap"] = delta > gap_threshold
 
-    # 5) Resumen estadístico sencillo
-    delta_valid = df_gaps["delta_s"].dropna()
+    # 5) Resumen estadístico sencillo (NumPy sobre el array de deltas)
+    delta_valid = delta[~np.isnan(delta)]
 
     resumen: Dict[str, float] = {}
-    if not delta_valid.empty:
+    if delta_valid.size:
+        p25, p75 = np.percentile(delta_valid, [25, 75])
         resumen = {
             "expected_sec": float(expected_sec),
             "gap_threshold": float(gap_threshold),
-            "count": int(delta_valid.count()),
+            "count": int(delta_valid.size),
             "min": float(delta_valid.min()),
             "max": float(delta_valid.max()),
             "mean": float(delta_valid.mean()),
-            "std": float(delta_valid.std()),
-            "p25": float(delta_valid.quantile(0.25)),
-            "p75": float(delta_valid.quantile(0.75)),
+            "std": float(delta_valid.std(ddof=1)) if delta_valid.size > 1 else float("nan"),
+            "p25": float(p25),
+            "p75": float(p75),
             "num_gaps": int(df_gaps["is_gap"].sum()),
         }
     else:
@@ -132,11 +141,29 @@ def agregar_flags_temporales(
     if df_sorted.empty:
         return df_sorted.copy()
 
-    df = df_sorted.copy()
-    gaps_idx = df_gaps.set_index("ts_utc")
-
-    df["delta_s"] = df["ts_utc"].map(gaps_idx["delta_s"])
-    df["is_gap"] = df["ts_utc"].map(gaps_idx["is_gap"]).fillna(False)
+    # Copia superficial: solo se añaden columnas nuevas (df_sorted no las ve),
+    # sin duplicar sus datos. Las columnas existentes se comparten: quien
+    # necesite modificarlas in situ debe copiar antes (limpiar_* ya lo hace).
+    df = df_sorted.copy(deep=False)
+
+    # df_gaps tiene timestamps únicos y ordenados: búsqueda binaria vectorizada
+    # en lugar de un map (hash) por cada columna
+    if not df_gaps["ts_utc"].is_monotonic_increasing:
+        df_gaps = df_gaps.sort_values("ts_utc")
+    gaps_ts = df_gaps["ts_utc"].to_numpy(dtype="datetime64[ns]")
+    ts = df["ts_utc"].to_numpy(dtype="datetime64[ns]")
+
+    # Centinela al final para timestamps sin fila en df_gaps (delta NaN, sin gap)
+    gaps_delta = np.r_[df_gaps["delta_s"].to_numpy(dtype=float), np.nan]
+    gaps_flag = np.r_[df_gaps["is_gap"].to_numpy(dtype=bool), False]
+
+    pos = np.searchsorted(gaps_ts, ts)
+    encontrado = pos < len(gaps_ts)
+    encontrado[encontrado] = gaps_ts[pos[encontrado]] == ts[encontrado]
+    pos[~encontrado] = len(gaps_ts)
+
+    df["delta_s"] = gaps_delta[pos]
+    df["is_gap"] = gaps_flag[pos]
 
     small_delta_max = expected_sec * small_delta_factor
 
@@ -1,14 +1,15 @@
 # phase2_impute.py
 
+import numpy as np
 import pandas as pd
 from typing import Tuple
 
 # Importamos grupos y diccionarios desde tu conf.py
 from conf import (
-    VIBRATION_VARS,
-    PHYSICAL_VARS,
-    CATEGORICAL_VARS,
-    ACCUMULATIVE_VARS,
+    VIBRATION_SET,
+    PHYSICAL_SET,
+    CATEGORICAL_SET,
+    ACCUMULATIVE_SET,
     PROCESSING_CODES,
     METRICS_MAP,       # ABB original -> canónico
     METRICS_MAP_REV,   # canónico -> ABB original (deberías tener: METRICS_MAP_REV = {v: k for k, v in METRICS_MAP.items()})
@@ -18,6 +19,13 @@ from conf import (
 # Estrategia de imputación según tipo de variable
 # -------------------------------------------------------------------
 
+# Precalculado una vez: nombre ABB original -> estrategia
+_ESTRATEGIA_POR_VARIABLE = {
+    **{v: "linear" for v in VIBRATION_SET | PHYSICAL_SET},
+    **{v: "ffill" for v in CATEGORICAL_SET | ACCUMULATIVE_SET},
+}
+
+
 def _estrategia_imputacion(variable_canonica: str) -> str:
     """
     Devuelve 'linear' o 'ffill' según el grupo de la variable,
@@ -28,17 +36,62 @@ def _estrategia_imputacion(variable_canonica: str) -> str:
     # Pasamos de canónico -> nombre original ABB (si existe)
     original_name = METRICS_MAP_REV.get(variable_canonica, variable_canonica)
 
-    if original_name in CATEGORICAL_VARS:
-        return "ffill"
-    if original_name in ACCUMULATIVE_VARS:
-        return "ffill"
-    if original_name in VIBRATION_VARS:
-        return "linear"
-    if original_name in PHYSICAL_VARS:
-        return "linear"
-
     # Si no sabemos qué es, usamos linear por defecto
-    return "linear"
+    return _ESTRATEGIA_POR_VARIABLE.get(original_name, "linear")
+
+
+# -------------------------------------------------------------------
+# Núcleo vectorizado: gaps pequeños en una matriz (filas = tiempo)
+# -------------------------------------------------------------------
+
+def _mascara_gaps_pequenos(na: np.ndarray, max_gap_steps: int) -> np.ndarray:
+    """
+    Para una matriz booleana de NaNs (filas = tiempo, columnas = variables),
+    devuelve True en los NaN que pertenecen a un segmento consecutivo de
+    longitud <= max_gap_steps dentro de su columna.
+    """
+    n, m = na.shape
+    # Recorremos columna a columna (orden F) con una fila separadora en False
+    # para que ningún segmento cruce de una columna a la siguiente.
+    plano = np.vstack([na, np.zeros((1, m), dtype=bool)]).ravel(order="F")
+
+    # Run-length: los bordes son los cambios de plano, con 0 al inicio
+    edges = np.flatnonzero(np.diff(np.r_[0, plano.view(np.int8)]))
+    starts, ends = edges[::2], edges[1::2]
+    lens = ends - starts
+
+    small_plano = np.zeros(plano.size, dtype=bool)
+    small_plano[np.flatnonzero(plano)[np.repeat(lens <= max_gap_steps, lens)]] = True
+
+    return small_plano.reshape(n + 1, m, order="F")[:n]
+
+
+def _aplicar_imputacion_limitada(
+    valores: np.ndarray,
+    valores_aux: np.ndarray,
+    code_imputed: np.ndarray,
+    max_gap_steps: int,
+    code_not_imputed: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Copia valores_aux solo en los gaps pequeños y construye la matriz de
+    processing_code (code_imputed trae un código por columna).
+    """
+    na = np.isnan(valores)
+    small = _mascara_gaps_pequenos(na, max_gap_steps)
+
+    # Una sola pasada por matriz con np.where en lugar de varias asignaciones
+    # enmascaradas. Gap pequeño -> valor de la imputación auxiliar y su código;
+    # gap grande -> se queda NaN con code_not_imputed. Fuera de los gaps el
+    # valor es original (no NaN), así que no hace falta repasar NaN restantes.
+    out = np.where(small, valores_aux, valores)
+    cod = np.where(
+        small,
+        np.broadcast_to(code_imputed, valores.shape),
+        np.where(na, np.int8(code_not_imputed), np.int8(0)),  # 0: original
+    ).astype(np.int8, copy=False)
+
+    return out, cod
 
 
 # -------------------------------------------------------------------
@@ -86,31 +139,16 @@ def _imputar_serie_limitada(
         # Método desconocido: no imputamos nada
         return s, codes
 
-    # Identificar segmentos consecutivos de NaNs
-    # Truco: cuando cambia is_na (True/False), incrementa el id de grupo
-    grupo = (is_na != is_na.shift()).cumsum()
-
-    for gid, mask_seg in is_na.groupby(grupo):
-        idxs = mask_seg[mask_seg].index  # índices donde is_na == True en este segmento
-
-        if len(idxs) == 0:
-            continue
-
-        segment_len = len(idxs)
-
-        if segment_len <= max_gap_steps:
-            # Gap pequeño -> imputable
-            # Copiamos de la serie auxiliar
-            s.loc[idxs] = s_aux.loc[idxs]
-            codes.loc[idxs] = code_imputed
-        else:
-            # Gap grande -> no imputamos nada, se queda NaN
-            codes.loc[idxs] = code_not_imputed
+    valores, cod = _aplicar_imputacion_limitada(
+        s.to_numpy(dtype=float).reshape(-1, 1),
+        s_aux.to_numpy(dtype=float).reshape(-1, 1),
+        np.array([code_imputed], dtype=np.int8),
+        max_gap_steps=max_gap_steps,
+        code_not_imputed=code_not_imputed,
+    )
 
-    # Aseguramos que cualquier posición que siga en NaN y no tenga código
-    # de imputación (1 o 2) se marque como missing_not_imputed (3)
-    still_na = s.isna() & (codes == 0)
-    codes.loc[still_na] = code_not_imputed
+    s = pd.Series(valores[:, 0], index=s.index, name=s.name)
+    codes = pd.Series(cod[:, 0], index=s.index, dtype="int8")
 
     return s, codes
 
@@ -130,7 +168,7 @@ def imputar_dataset_ancho(
         index  = ts_slot (DatetimeIndex, ej. cada 15 min)
         cols   = variables canónicas (ej. 'acc_rms_axial', 'skin_temp', ...)
 
-    Para cada columna:
+    Para cada columna (vectorizado: una interpolación por estrategia):
       - decide la estrategia ('linear' o 'ffill') según el tipo de variable
       - imputa sólo gaps de longitud <= max_gap_steps
       - marca processing_code por celda:
@@ -149,36 +187,40 @@ def imputar_dataset_ancho(
 
     df = df_wide.copy()
 
-    # Aseguramos numérico en lo posible (NaNs se preservan)
-    for col in df.columns:
-        df[col] = pd.to_numeric(df[col], errors="coerce")
-
-    # Inicializamos matriz de códigos en 0 (original)
-    codes = pd.DataFrame(
-        0,
-        index=df.index,
-        columns=df.columns,
-        dtype="int8",
+    # Aseguramos numérico en lo posible (NaNs se preservan); tras el pivot
+    # lo normal es que todo sea float64 y no haya nada que convertir
+    non_num = df.select_dtypes(exclude="number").columns
+    if len(non_num):
+        df[non_num] = df[non_num].apply(pd.to_numeric, errors="coerce")
+
+    # Estrategia según tipo de variable (usando nombres originales ABB)
+    metodos = [_estrategia_imputacion(col) for col in df.columns]
+    linear_cols = [c for c, m in zip(df.columns, metodos) if m == "linear"]
+    ffill_cols = [c for c, m in zip(df.columns, metodos) if m == "ffill"]
+
+    # Imputación auxiliar global: una llamada por estrategia para todas
+    # sus columnas (interpolate 'time' requiere DatetimeIndex)
+    df_aux = df.copy()
+    if linear_cols and df[linear_cols].isna().any().any():
+        df_aux[linear_cols] = df[linear_cols].interpolate(method="time")
+    if ffill_cols:
+        df_aux[ffill_cols] = df[ffill_cols].ffill()
+
+    code_imputed = np.array(
+        [1 if m == "linear" else 2 for m in metodos],  # 1: linear, 2: ffill
+        dtype=np.int8,
     )
 
-    # Imputación columna por columna
-    for col in df.columns:
-        s = df[col]
-
-        # Estrategia según tipo de variable (usando nombres originales ABB)
-        metodo = _estrategia_imputacion(col)
-
-        s_out, cod_col = _imputar_serie_limitada(
-            s,
-            metodo=metodo,
-            max_gap_steps=max_gap_steps,
-            code_linear=1,
-            code_ffill=2,
-            code_not_imputed=3,
-        )
+    valores, cod = _aplicar_imputacion_limitada(
+        df.to_numpy(dtype=float),
+        df_aux.to_numpy(dtype=float),
+        code_imputed,
+        max_gap_steps=max_gap_steps,
+        code_not_imputed=3,
+    )
 
-        df[col] = s_out
-        codes[col] = cod_col
+    df = pd.DataFrame(valores, index=df.index, columns=df.columns)
+    codes = pd.DataFrame(cod, index=df.index, columns=df.columns)
 
     return df, codes
 
@@ -192,27 +234,19 @@ def dataset_ancho_a_largo_con_codigos(
     codes_wide: pd.DataFrame,
 ) -> pd.DataFrame:
 
-    # 1) Valores (preservamos NaN):
-    df_val = (
-        df_imputed.stack(dropna=False)   # <--- 🔥 IMPORTANTÍSIMO
-        .reset_index()
-    )
-    df_val.columns = ["ts_slot", "variable_canonica", "valor"]
-
-    # 2) Codes (también preservamos 0, 1, 2, 3 en todas las posiciones)
-    df_codes = (
-        codes_wide.stack(dropna=False)   # <--- 🔥 también necesario
-        .reset_index()
-    )
-    df_codes.columns = ["ts_slot", "variable_canonica", "processing_code"]
-
-    # 3) Merge explícito por ts_slot + variable_canonica
-    df_long = pd.merge(
-        df_val,
-        df_codes,
-        on=["ts_slot", "variable_canonica"],
-        how="left",
-    )
+    # Valores y códigos ya están alineados (mismo índice y columnas):
+    # construimos el formato largo directamente, sin stack ni merge.
+    # Orden fila a fila: cada ts_slot con todas sus variables (igual que stack).
+    codes_wide = codes_wide.reindex(index=df_imputed.index, columns=df_imputed.columns)
+    n, m = df_imputed.shape
+
+    df_long = pd.DataFrame({
+        "ts_slot": np.repeat(df_imputed.index.to_numpy(), m),
+        "variable_canonica": np.tile(df_imputed.columns.to_numpy(), n),
+        # NaN se preservan en todas las posiciones
+        "valor": df_imputed.to_numpy().ravel(order="C"),
+        "processing_code": codes_wide.to_numpy().ravel(order="C"),
+    })
 
     # 4) Mapear la variable ABB original
     df_long["variable"] = df_long["variable_canonica"].map(METRICS_MAP_REV)
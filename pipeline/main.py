@@ -11,6 +11,20 @@ from sync_timestamp import construir_dataset_ancho_sin_imputar, assign_time_slot
 import os
 
 
+def exportar_ancho(df, ruta_base: str) -> str:
+    """
+    Guarda un dataset ancho en Parquet (zstd) si hay motor disponible
+    (pyarrow); si no, en CSV como antes. Devuelve la ruta escrita.
+    """
+    try:
+        ruta = f"{ruta_base}.parquet"
+        df.to_parquet(ruta, compression="zstd")
+    except ImportError:  # sin pyarrow: CSV
+        ruta = f"{ruta_base}.csv"
+        df.to_csv(ruta, index=True)
+    return ruta
+
+
 def pausar_y_continuar(mensaje="Presione ENTER para continuar..."):
     input(mensaje)
 
@@ -113,14 +127,19 @@ def main():
     # 2) Resumen por banderas lógicas
    
     print("\n=== CONTEO POR BANDERAS ==\n")
+    # Una sola reducción para todas las banderas presentes
+    flag_sums = df_limpio[[c for c in flag_cols if c in df_limpio.columns]].sum()
     for col in flag_cols:
-        if col in df_limpio.columns:
-            n = int(df_limpio[col].sum())
+        if col in flag_sums.index:
+            n = int(flag_sums[col])
             perc = (n / total_rows) * 100 if total_rows > 0 else 0
             print(f"  {col:<25}: {n} filas ({perc:.2f} %)")
         else:
             print(f"  {col}: (no existe en el DataFrame)")
 
+    # Posiciones de filas por código, calculadas una vez (sin re-escanear
+    # df_limpio en cada consulta del bucle interactivo)
+    posiciones_por_codigo = df_limpio.groupby("quality_code", sort=True).indices
     codigos_disponibles = list(quality_counts.keys())
     print("\n=== VISUALIZACIÓN DETALLADA DE DATOS CON INDICADOR DE CALIDAD ASIGNADO ===\n")
     print(f"Códigos de Calidad disponibles para inspeccionar: {codigos_disponibles}")
@@ -136,9 +155,9 @@ def main():
                 label = QUALITY_CODES.get(target_code, "Desconocido")
                 
                 print(f"\n=== DATOS CON INDICADOR DE CALIDAD {target_code} ({label}) ===\n")
-                df_sample = df_limpio[df_limpio["quality_code"] == target_code][
+                df_sample = df_limpio.iloc[posiciones_por_codigo[target_code][:10]][
                     ["ts_utc", "variable", "valor", "quality_code"]
-                ].head(10)
+                ]
                 print(df_sample)
             else:
                 print(f" El código '{user_input}' no es válido")
@@ -237,7 +256,7 @@ def main():
     )
 
     # ============================
-    # OPCIÓN: GUARDAR DATASET ANCHO A CSV
+    # OPCIÓN: GUARDAR DATASET ANCHO (Parquet, o CSV sin pyarrow)
     # ============================
     output_dir = "exports_wide"
     os.makedirs(output_dir, exist_ok=True)
@@ -245,14 +264,12 @@ def main():
     base_name = f"despliegue_{despliegue_id}"
 
     # 1) Valores imputados (wide)
-    csv_valores = os.path.join(output_dir, f"{base_name}_wide_valores.csv")
-    df_wide_imputed.to_csv(csv_valores, index=True)
-    print(f"\n[INFO] Dataset ancho de VALORES guardado en: {csv_valores}")
+    ruta_valores = exportar_ancho(df_wide_imputed, os.path.join(output_dir, f"{base_name}_wide_valores"))
+    print(f"\n[INFO] Dataset ancho de VALORES guardado en: {ruta_valores}")
 
     # 2) Códigos de procesamiento (wide)
-    csv_codigos = os.path.join(output_dir, f"{base_name}_wide_codigos.csv")
-    codes_wide.to_csv(csv_codigos, index=True)
-    print(f"[INFO] Dataset ancho de CÓDIGOS guardado en: {csv_codigos}")
+    ruta_codigos = exportar_ancho(codes_wide, os.path.join(output_dir, f"{base_name}_wide_codigos"))
+    print(f"[INFO] Dataset ancho de CÓDIGOS guardado en: {ruta_codigos}")
 
 
     col = "skin_temp"  # o la que quieras
@@ -1,5 +1,6 @@
 # phase2_sync.py
 
+import numpy as np
 import pandas as pd
 from typing import Tuple, Optional
 from conf import METRICS_MAP
@@ -48,20 +49,27 @@ def assign_time_slots(
     if "ts_utc" not in df.columns:
         raise ValueError("El DataFrame no tiene la columna 'ts_utc'.")
 
-    df2 = df.copy()
-    df2["ts_utc"] = pd.to_datetime(df2["ts_utc"])
+    # Sin copiar df entero: se calculan los arrays y solo se materializan
+    # las filas dentro de tolerancia
+    ts_utc = pd.to_datetime(df["ts_utc"])
 
     # Proponer slot redondeado
-    df2["ts_slot"] = df2["ts_utc"].dt.round(freq)
+    ts_slot = ts_utc.dt.round(freq)
 
-    # Diferencia absoluta en segundos entre el original y el slot
-    diff = (df2["ts_utc"] - df2["ts_slot"]).dt.total_seconds().abs()
+    # Diferencia absoluta entre el original y el slot, comparada como
+    # timedelta64 en NumPy (sin pasar por segundos float ni Series intermedias;
+    # NaT compara como False)
+    diff = np.abs((ts_utc - ts_slot).to_numpy())
 
     # Bandera de dentro de tolerancia de jitter
-    df2["is_within_jitter"] = diff <= jitter_max_seconds
+    within = diff <= pd.Timedelta(seconds=jitter_max_seconds).to_timedelta64()
 
     # Nos quedamos solo con las mediciones que consideramos jitter corregible
-    df_in = df2[df2["is_within_jitter"]].copy()
+    df_in = df[within].assign(
+        ts_utc=ts_utc[within],
+        ts_slot=ts_slot[within],
+        is_within_jitter=True,
+    )
 
     return df_in
 
@@ -70,6 +78,18 @@ def assign_time_slots(
 # 3) Colapsar múltiples lecturas por slot (último valor)
 # ==========================================================
 
+def _clave_orden(s: pd.Series) -> np.ndarray:
+    """
+    Clave numérica para np.lexsort: timestamps como int64 (NaT al final,
+    como en sort_values); el resto, tal cual.
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        nat = s.isna().to_numpy()
+        clave = s.array.asi8
+        return np.where(nat, np.iinfo(np.int64).max, clave) if nat.any() else clave
+    return s.to_numpy()
+
+
 def collapse_by_slot_and_variable(df_slots: pd.DataFrame) -> pd.DataFrame:
     """
     Colapsa todas las mediciones que caen en el mismo:
@@ -83,33 +103,52 @@ def collapse_by_slot_and_variable(df_slots: pd.DataFrame) -> pd.DataFrame:
     if df_slots.empty:
         return df_slots.copy()
 
-    df = df_slots.copy()
-
     # Columnas de contexto (si existen)
     context_cols = [
         c for c in ["despliegue_id", "asset_codigo", "motor_codigo"]
-        if c in df.columns
+        if c in df_slots.columns
     ]
 
     group_cols = context_cols + ["ts_slot", "variable"]
 
-    # Aseguramos que 'valor' sea numérico donde tenga sentido
-    df["valor"] = pd.to_numeric(df["valor"], errors="coerce")
-
-    # Ordenamos para que "last" sea realmente el último temporalmente
-    sort_cols = []
-    if "ts_utc" in df.columns:
-        sort_cols.append("ts_utc")
-    if "ingesta_id" in df.columns:
-        sort_cols.append("ingesta_id")
+    # Solo las columnas de salida (sin copiar el resto de df_slots)
+    df = df_slots[group_cols + ["valor"]]
 
-    if sort_cols:
-        df = df.sort_values(sort_cols)
-
-    df_collapsed = (
-        df.groupby(group_cols, as_index=False)
-          .agg({"valor": "last"})
-    )
+    # Aseguramos que 'valor' sea numérico donde tenga sentido
+    df = df.assign(valor=pd.to_numeric(df["valor"], errors="coerce"))
+
+    # Claves de grupo como códigos enteros ordenados (factorize): sin hashear
+    # strings en cada paso. Código -1 = clave nula; groupby las descarta.
+    codigos = [pd.factorize(df[c], sort=True)[0] for c in group_cols]
+    con_clave = np.logical_and.reduce([c >= 0 for c in codigos])
+    if not con_clave.all():
+        df = df[con_clave]
+        codigos = [c[con_clave] for c in codigos]
+        if df.empty:
+            return df.reset_index(drop=True)
+
+    # "last" de groupby = último valor NO nulo del grupo (NaN solo si todo el
+    # grupo es NaN). Un único lexsort por (grupo, valor no nulo, ts_utc,
+    # ingesta_id) deja en la última fila de cada grupo su último valor no nulo.
+    orden_tiempo = [df["valor"].notna().to_numpy()]
+    for c in ("ts_utc", "ingesta_id"):  # "último" temporalmente
+        if c in df_slots.columns:
+            orden_tiempo.append(_clave_orden(df_slots[c])[con_clave])
+
+    try:
+        # Una sola clave int64 por grupo (en orden lexicográfico de group_cols)
+        grupo = np.ravel_multi_index(codigos, [int(c.max()) + 1 for c in codigos])
+        orden = np.lexsort(orden_tiempo[::-1] + [grupo])
+        g = grupo[orden]
+        ultimo = np.r_[g[1:] != g[:-1], True]
+    except ValueError:
+        # Demasiadas combinaciones para un int64: una clave por columna
+        orden = np.lexsort(orden_tiempo[::-1] + codigos[::-1])
+        g = np.stack([c[orden] for c in codigos])
+        ultimo = np.r_[(g[:, 1:] != g[:, :-1]).any(axis=0), True]
+
+    # Filas ya en el orden de las claves de grupo (como groupby)
+    df_collapsed = df.iloc[orden[ultimo]].reset_index(drop=True)
 
     return df_collapsed
 
@@ -129,11 +168,17 @@ def aplicar_mapeo_canonico(df: pd.DataFrame) -> pd.DataFrame:
     if "variable" not in df.columns:
         raise ValueError("Falta columna 'variable' en el DataFrame.")
 
-    df2 = df.copy()
-    df2["variable_canonica"] = df2["variable"].map(METRICS_MAP)
-    
-    df2["variable"] = df2["variable_canonica"].fillna(df2["variable"])
+    # Pocos nombres distintos: se resuelve el mapeo una vez por nombre único
+    # y se expande a las filas con un take sobre los códigos (sin map + fillna
+    # fila a fila). La posición extra final cubre el código -1 (nulos).
+    codigos, nombres = pd.factorize(df["variable"])
+    canonica = np.array([METRICS_MAP.get(n, np.nan) for n in nombres] + [np.nan], dtype=object)
+    plana = np.array([METRICS_MAP.get(n, n) for n in nombres] + [np.nan], dtype=object)
 
+    df2 = df.assign(
+        variable=plana[codigos],
+        variable_canonica=canonica[codigos],
+    )
 
     return df2
 
@@ -142,6 +187,36 @@ def aplicar_mapeo_canonico(df: pd.DataFrame) -> pd.DataFrame:
 # 5) Pivot a formato ancho → estado del activo
 # ==========================================================
 
+def _pivotar_disperso(df: pd.DataFrame, index: str, columns: str, values: str) -> pd.DataFrame:
+    """
+    Equivalente a df.pivot(index, columns, values) con filas y columnas
+    ordenadas, pero escribiendo cada valor directamente en su celda
+    (factorize + asignación por posición), sin MultiIndex ni unstack.
+    Como pivot, falla si hay entradas duplicadas; con claves nulas se
+    delega en pivot.
+    """
+    filas, idx = pd.factorize(df[index], sort=True)
+    cols, nombres = pd.factorize(df[columns], sort=True)
+    if (filas < 0).any() or (cols < 0).any():
+        return df.pivot(index=index, columns=columns, values=values)
+
+    n_filas, n_cols = len(idx), len(nombres)
+    celda = filas.astype(np.int64) * n_cols + cols
+    if len(celda) and np.bincount(celda, minlength=n_filas * n_cols).max() > 1:
+        raise ValueError("Index contains duplicate entries, cannot reshape")
+
+    vals = df[values].to_numpy()
+    dtype = vals.dtype if vals.dtype.kind == "f" else (np.float64 if vals.dtype.kind in "iub" else object)
+    matriz = np.full((n_filas, n_cols), np.nan, dtype=dtype)
+    matriz[filas, cols] = vals
+
+    return pd.DataFrame(
+        matriz,
+        index=pd.Index(idx, name=index),
+        columns=pd.Index(nombres, name=columns),
+    )
+
+
 def pivotar_estado_activo(df: pd.DataFrame) -> pd.DataFrame:
     """
     Pivot a formato ancho:
@@ -156,13 +231,8 @@ def pivotar_estado_activo(df: pd.DataFrame) -> pd.DataFrame:
         if col not in df.columns:
             raise ValueError(f"Falta columna '{col}' en el DataFrame.")
 
-    df_pivot = df.pivot(
-        index="ts_slot",
-        columns="variable_canonica",
-        values="valor"
-    )
-
-    df_pivot.sort_index(inplace=True)
+    # Scatter directo a la matriz densa (ya sale ordenada por ts_slot)
+    df_pivot = _pivotar_disperso(df, "ts_slot", "variable_canonica", "valor")
     df_pivot.index.name = "ts_slot"
 
     return df_pivot
@@ -0,0 +1,62 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+
+
+def ts_iso_utc(ts: pd.Series) -> pd.Series:
+    """
+    Formatea una serie de timestamps a ISO 8601 (equivalente a
+    Timestamp.isoformat() fila a fila, pero vectorizado en NumPy).
+    Timestamps con zona se expresan en UTC; sin zona se dejan sin offset.
+    """
+    naive = ts.dt.tz is None
+    if not naive:
+        ts = ts.dt.tz_convert("UTC").dt.tz_localize(None)
+    v = ts.to_numpy()
+
+    iso = np.datetime_as_string(v, unit="s")
+    # isoformat() solo incluye microsegundos cuando son distintos de cero,
+    # y nanosegundos cuando los hay
+    v_us = v.astype("datetime64[us]")
+    con_us = v_us != v.astype("datetime64[s]")
+    if con_us.any():
+        iso = np.where(con_us, np.datetime_as_string(v, unit="us"), iso)
+    con_ns = v_us != v
+    if con_ns.any():
+        iso = np.where(con_ns, np.datetime_as_string(v, unit="ns"), iso)
+    if not naive:
+        iso = np.char.add(iso, "+00:00")
+    return pd.Series(iso, index=ts.index, dtype=object)
+
+
+def payloads_a_dicts(df_payload: pd.DataFrame) -> List[dict]:
+    """
+    Convierte df_payload en una lista de dicts (uno por fila).
+    Equivale a to_dict("records"), pero con tolist() por columna los
+    valores ya salen como tipos nativos de Python, sin conversión por celda.
+    """
+    cols = list(df_payload.columns)
+    return [dict(zip(cols, fila)) for fila in zip(*(df_payload[c].tolist() for c in cols))]
+
+
+def map_acotado(
+    executor: ThreadPoolExecutor,
+    fn: Callable,
+    elementos: Iterable,
+    max_pendientes: int,
+) -> Iterator[Tuple[object, object]]:
+    """
+    Como executor.map, pero consumiendo `elementos` poco a poco: como mucho
+    max_pendientes tareas en vuelo. Devuelve (elemento, resultado) en orden.
+    """
+    pendientes = deque()
+    for elem in elementos:
+        pendientes.append((elem, executor.submit(fn, elem)))
+        if len(pendientes) >= max_pendientes:
+            elem, fut = pendientes.popleft()
+            yield elem, fut.result()
+    while pendientes:
+        elem, fut = pendientes.popleft()
+        yield elem, fut.result()
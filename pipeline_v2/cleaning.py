@@ -9,6 +9,9 @@ from conf import MAX_JUMP_THRESHOLD, STUCK_VARIANCE_THRESHOLD,STUCK_WINDOW_N, NO
 # 🚨 Importaciones necesarias (asumimos que conf.py tiene METRICS_MAP, RESAMPLE_FREQUENCY, etc.)
 from conf import RESAMPLE_FREQUENCY, METRICS_MAP, CATEGORICAL_VARS, VIBRATION_VARS, PHYSICAL_VARS,ACCUMULATIVE_VARS, CATEGORICAL_DOMAINS
 
+# Variables numéricas (continuas o acumulativas): se calcula una vez al importar
+NUMERIC_VARS = frozenset(VIBRATION_VARS) | frozenset(PHYSICAL_VARS) | frozenset(ACCUMULATIVE_VARS)
+
 # -----------------------------------------------------------
 # 1. PIVOTEO Y MANEJO DE SINCRONIZACIÓN (Formato Largo -> Ancho)
 # -----------------------------------------------------------
@@ -16,38 +19,79 @@ from conf import RESAMPLE_FREQUENCY, METRICS_MAP, CATEGORICAL_VARS, VIBRATION_VA
 # Se asume que RESAMPLE_FREQUENCY (ej. '15min'), METRICS_MAP, y ACCUMULATIVE_VARS 
 # están accesibles dentro de esta función o se pasan como argumentos.
 
+def _floor_a_frecuencia(ts: pd.Series, freq: str) -> pd.Series:
+    """
+    Equivalente a ts.dt.floor(freq) con aritmética entera sobre los
+    nanosegundos (floor(ns / paso) * paso). Para frecuencias no fijas,
+    otras resoluciones o zonas horarias distintas de UTC se usa dt.floor.
+    """
+    try:
+        paso = pd.Timedelta(freq).value
+    except ValueError:
+        return ts.dt.floor(freq)
+
+    tz = ts.dt.tz
+    if paso <= 0 or ts.dt.unit != 'ns' or (tz is not None and str(tz) != 'UTC'):
+        return ts.dt.floor(freq)
+
+    ns = ts.array.asi8
+    floored = (ns // paso) * paso
+    nat = ts.isna().to_numpy()
+    if nat.any():
+        floored[nat] = np.iinfo(np.int64).min  # NaT
+    return pd.Series(pd.DatetimeIndex(floored.view('M8[ns]'), tz=tz), index=ts.index, name=ts.name)
+
+
 def _pivotar_y_mapear(df_quality: pd.DataFrame, metrics_map: dict, 
                       resample_freq: str, accumulative_vars: list) -> pd.DataFrame:
     """
     Sincroniza el tiempo, pre-agrega contadores y transforma el DF de largo a ancho.
     """
-    df_proc = df_quality.copy()
-
     # 1. 🚨 SINCRONIZACIÓN TEMPORAL (Redondeo)
     # Redondea el ts_utc a la frecuencia de remuestreo (ej. 19:01:01 -> 19:00:00)
-    df_proc['ts_utc_rounded'] = df_proc['ts_utc'].dt.floor(resample_freq)
+    # (sin copiar df_quality: solo se necesitan las claves y 'valor')
+    ts_rounded = _floor_a_frecuencia(df_quality['ts_utc'], resample_freq)
 
     # 2. 🚨 PRE-AGREGACIÓN PARA MANEJO DE JITTER Y MONOTONÍA
     # Si varias lecturas caen en el mismo cubo de tiempo (debido al redondeo):
-    
-    # a) Identificar qué función de agregación usar por variable
-    def get_agg_function(series: pd.Series):
-        var_name = series.name # Nombre de la variable
-        if var_name in accumulative_vars:
-            # Usar MAX para Contadores (garantiza la monotonicidad y el valor más alto)
-            return 'max'
-        else:
-            # Usar el primer valor, la media, o el último para otras variables
-            # Usaremos la media o el último valor (depende de tu estándar), aquí usaremos mean() o last()
-            # Por simplicidad y consistencia, usemos 'mean()' para continuas
-            return 'mean' 
-
-    # b) Agrupar por el nuevo timestamp y la variable, aplicando la función de agregación
-    df_agg = df_proc.groupby(['ts_utc_rounded', 'variable'])['valor'].agg(get_agg_function).reset_index()
+
+    # a) Claves (cubo, variable) como códigos enteros ordenados. Las filas
+    # con clave nula se descartan, como en un groupby.
+    variable = df_quality['variable']
+    valores = df_quality['valor'].to_numpy(dtype=np.float64, na_value=np.nan)
+    con_clave = ts_rounded.notna().to_numpy() & variable.notna().to_numpy()
+    if not con_clave.all():
+        ts_rounded, variable, valores = ts_rounded[con_clave], variable[con_clave], valores[con_clave]
+    ts_code, ts_vals = pd.factorize(ts_rounded, sort=True)
+    var_code, var_vals = pd.factorize(variable, sort=True)
+
+    # b) Cada fila cae en una celda (cubo, variable) de la matriz ancha: las
+    # agregaciones se acumulan directamente por celda con bincount (una
+    # pasada, sin ordenar ni hashear)
+    n_ts, n_vars = len(ts_vals), len(var_vals)
+    celda = ts_code.astype(np.int64) * n_vars + var_code
+    es_valido = ~np.isnan(valores)
+    n_validos = np.bincount(celda[es_valido], minlength=n_ts * n_vars)
+
+    # MEAN para continuas y demás (NaN si la celda no tiene valores válidos)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        matriz = np.bincount(celda[es_valido], weights=valores[es_valido], minlength=n_ts * n_vars) / n_validos
+
+    # c) MAX para Contadores (garantiza la monotonicidad y el valor más alto):
+    # solo sobre las filas de variables acumulativas
+    es_acumulativa = np.asarray(pd.Index(var_vals).isin(accumulative_vars))
+    if es_acumulativa.any():
+        filas_acum = es_valido & es_acumulativa[var_code]
+        maximo = np.full(n_ts * n_vars, -np.inf)
+        np.maximum.at(maximo, celda[filas_acum], valores[filas_acum])
+        celdas_acum = np.tile(es_acumulativa, n_ts)
+        matriz[celdas_acum] = np.where(n_validos[celdas_acum] > 0, maximo[celdas_acum], np.nan)
 
     # 3. PIVOTEO
-    # Convertir el DataFrame de largo a ancho (cada variable es una columna)
-    df_ancho = df_agg.pivot(index='ts_utc_rounded', columns='variable', values='valor')
+    # La matriz de celdas ya es el formato ancho
+    # (filas: cubos ordenados; columnas: variables ordenadas)
+    matriz = matriz.reshape(n_ts, n_vars)
+    df_ancho = pd.DataFrame(matriz, index=pd.Index(ts_vals), columns=pd.Index(var_vals))
 
     # 4. MAPEO Y LIMPIEZA DE COLUMNAS
     # Aplicar el mapeo de nombres
@@ -67,22 +111,28 @@ def _remuestrear_y_rellenar(df_ancho: pd.DataFrame, freq: str, interpolation_lim
     """
     Remuestrea a la frecuencia uniforme, interpola gaps pequeños y preserva gaps grandes.
     """
-    logging.info(f"-> Remuestreando a frecuencia uniforme de {freq}...")
+    logging.info("-> Remuestreando a frecuencia uniforme de %s...", freq)
     
     # 1. Remuestreo base: crea un índice de tiempo uniforme (con NaNs en los huecos)
     df_resampled = df_ancho.resample(freq).asfreq()
     
     # 2. Aplicar interpolación/relleno solo si el límite es mayor a 0
     if interpolation_limit > 0:
-        logging.info(f"-> Aplicando ffill/bfill con límite de {interpolation_limit} intervalos.")
+        logging.info("-> Aplicando ffill/bfill con límite de %s intervalos.", interpolation_limit)
         # Usamos .ffill() seguido de .bfill() con el mismo límite para interpolación simétrica
-        df_resampled = df_resampled.ffill(limit=interpolation_limit).bfill(limit=interpolation_limit)
+        # (in place: df_resampled ya es una copia nueva y se evitan dos matrices intermedias)
+        df_resampled.ffill(limit=interpolation_limit, inplace=True)
+        df_resampled.bfill(limit=interpolation_limit, inplace=True)
     else:
         logging.info("-> Interpolation_limit es 0. Se mantienen los NaNs en los huecos temporales.")
     
     # Flag de Missing (para gaps grandes)
     # NOTA: En este punto, los NaNs representan gaps grandes O NaNs originales
-    df_resampled['is_missing_general'] = df_resampled.isna().any(axis=1)
+    valores = df_resampled.to_numpy()
+    if valores.dtype.kind == 'f':
+        df_resampled['is_missing_general'] = np.isnan(valores).any(axis=1)
+    else:
+        df_resampled['is_missing_general'] = df_resampled.isna().any(axis=1)
 
     return df_resampled
 
@@ -165,67 +215,87 @@ def compute_vibration_stats(df: pd.DataFrame) -> pd.DataFrame:
     - Devuelve, por variable:
         count, mean, std, min, q1, q3, iqr, max
     """
-    df_vib = df[df["variable"].isin(VIBRATION_VARS)].copy()
-    df_vib["valor"] = pd.to_numeric(df_vib["valor"], errors="coerce")
-    df_vib = df_vib.dropna(subset=["valor"])
+    mask_vib = df["variable"].isin(VIBRATION_VARS).to_numpy()
+    valores = pd.to_numeric(df["valor"][mask_vib], errors="coerce").to_numpy(
+        dtype=np.float64, na_value=np.nan
+    )
+    variables_fila = df["variable"].to_numpy()[mask_vib]
+    con_valor = ~np.isnan(valores)
+    valores = valores[con_valor]
+    variables_fila = variables_fila[con_valor]
 
-    if df_vib.empty:
+    if valores.size == 0:
         return pd.DataFrame(columns=[
             "variable", "count", "mean",
             "min", "q1", "q3", "iqr", "max"
         ])
 
-    # Estadísticos básicos
-    stats = df_vib.groupby("variable")["valor"].agg(
-        count="count",
-        mean="mean",
-        min="min",
-        max="max",
-    )
+    # Un solo ordenamiento por (variable, valor): cada variable queda en un
+    # bloque contiguo y ordenado, del que salen todos los estadísticos
+    codigos, variables = pd.factorize(variables_fila, sort=True)
+    orden = np.lexsort((valores, codigos))
+    v = valores[orden]
+
+    count = np.bincount(codigos, minlength=len(variables))
+    inicio = np.r_[0, np.cumsum(count)[:-1]]
+    fin = inicio + count - 1
+
+    def _cuantil(q: float) -> np.ndarray:
+        # Interpolación lineal, como quantile() de pandas
+        pos = q * (count - 1)
+        lo = inicio + np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, fin)
+        frac = pos - np.floor(pos)
+        with np.errstate(invalid="ignore"):
+            interp = v[lo] + (v[hi] - v[lo]) * frac
+        return np.where(frac > 0, interp, v[lo])
 
     # Cuartiles e IQR
-    q1 = df_vib.groupby("variable")["valor"].quantile(0.25)
-    q3 = df_vib.groupby("variable")["valor"].quantile(0.75)
-    iqr = q3 - q1
-
-    stats["q1"] = q1
-    stats["q3"] = q3
-    stats["iqr"] = iqr
-
-    stats = stats[["count", "mean", "min","max", "q1", "q3", "iqr"]]
-    return stats.reset_index()
+    q1 = _cuantil(0.25)
+    q3 = _cuantil(0.75)
+
+    stats = pd.DataFrame({
+        "variable": variables,
+        "count": count,
+        "mean": np.add.reduceat(v, inicio) / count,
+        "min": v[inicio],
+        "max": v[fin],
+        "q1": q1,
+        "q3": q3,
+        "iqr": q3 - q1,
+    })
+    return stats
 
 
 # =====================================================
 # 4) Marcación de anomalías por grupo
 # =====================================================
+# Todos los mark_* devuelven el DF con sus banderas. Con copy=False marcan
+# sobre el mismo DF (sin copiarlo): limpiar_por_variable_deteccion copia una
+# sola vez al inicio y encadena los mark_* sobre esa copia.
 
-def mark_missing(df: pd.DataFrame) -> pd.DataFrame:
-    df_out = df.copy()
+def mark_missing(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
+    df_out = df.copy() if copy else df
     df_out["is_missing"] = df_out["valor"].isna()
     return df_out
 
 
-def mark_invalid_physical(df: pd.DataFrame) -> pd.DataFrame:
+def mark_invalid_physical(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """
     Marca valores físicamente imposibles:
       - cualquier valor numérico < 0 en continuas o acumulativas
     """
-    df_out = df.copy()
-    df_out["is_invalid_physical"] = False
+    df_out = df.copy() if copy else df
 
-    mask_num = df_out["variable"].isin(VIBRATION_VARS + PHYSICAL_VARS + ACCUMULATIVE_VARS)
-    df_num = df_out[mask_num].copy()
-
-    df_num["valor"] = pd.to_numeric(df_num["valor"], errors="coerce")
-
-    invalid_idx = df_num.index[df_num["valor"] < 0]
-    df_out.loc[invalid_idx, "is_invalid_physical"] = True
+    # Una sola expresión vectorizada sobre todo el DF (sin copiar el subconjunto)
+    mask_num = df_out["variable"].isin(NUMERIC_VARS).to_numpy()
+    vals = pd.to_numeric(df_out["valor"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    df_out["is_invalid_physical"] = mask_num & (vals < 0)
 
     return df_out
 
 
-def mark_vibration_outliers(df: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFrame:
+def mark_vibration_outliers(df: pd.DataFrame, stats: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """
     Marca valores altos y extremos en variables de vibración usando IQR.
 
@@ -241,11 +311,14 @@ def mark_vibration_outliers(df: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFra
       - is_outlier tiene prioridad: si es outlier, no se marca como high.
       - Si IQR <= 0 o faltan Q1/Q3, no se marcan flags para esa variable.
     """
-    df_out = df.copy()
+    df_out = df.copy() if copy else df
     df_out["is_high"] = False
     df_out["is_outlier"] = False
 
-    if stats.empty:
+    # Filtramos solo variables de vibración (sin stats o sin filas de
+    # vibración no hay nada que marcar: se evita todo el trabajo siguiente)
+    mask_vib = df_out["variable"].isin(VIBRATION_VARS).to_numpy()
+    if stats.empty or not mask_vib.any():
         return df_out
 
     # Mapas por variable
@@ -253,89 +326,83 @@ def mark_vibration_outliers(df: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFra
     q3_map: Dict[str, float] = dict(zip(stats["variable"], stats["q3"]))
     iqr_map: Dict[str, float] = dict(zip(stats["variable"], stats["iqr"]))
 
-    # Filtramos solo variables de vibración
-    mask_vib = df_out["variable"].isin(VIBRATION_VARS)
-    df_vib = df_out[mask_vib].copy()
-    df_vib["valor"] = pd.to_numeric(df_vib["valor"], errors="coerce")
-
-    def _flags(row):
-        var = row["variable"]
-        val = row["valor"]
+    df_vib = df_out.loc[mask_vib, ["variable", "valor"]]
 
-        if pd.isna(val):
-            return False, False
+    # Umbrales alineados fila a fila (NaN si la variable no tiene estadísticos)
+    q1 = df_vib["variable"].map(q1_map).to_numpy(dtype=np.float64)
+    q3 = df_vib["variable"].map(q3_map).to_numpy(dtype=np.float64)
+    iqr = df_vib["variable"].map(iqr_map).to_numpy(dtype=np.float64)
+    val = pd.to_numeric(df_vib["valor"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
 
-        q1 = q1_map.get(var)
-        q3 = q3_map.get(var)
-        iqr = iqr_map.get(var)
+    # Si falta algo o IQR no es positivo, no marcamos (NaN compara como False)
+    iqr_ok = iqr > 0
 
-        # Si falta algo o IQR no es positivo, no marcamos
-        if q1 is None or q3 is None or iqr is None or iqr <= 0:
-            return False, False
+    # Outlier extremo
+    is_out = iqr_ok & ((val < q1 - 3.0 * iqr) | (val > q3 + 3.0 * iqr))
 
-        # Umbrales
-        low_high = q1 - 1.5 * iqr
-        high_high = q3 + 1.5 * iqr
+    # Zona alta (solo si no es extremo)
+    is_high = iqr_ok & ~is_out & ((val < q1 - 1.5 * iqr) | (val > q3 + 1.5 * iqr))
 
-        low_out = q1 - 3.0 * iqr
-        high_out = q3 + 3.0 * iqr
+    df_out.loc[mask_vib, "is_high"] = is_high
+    df_out.loc[mask_vib, "is_outlier"] = is_out
 
-        # Outlier extremo
-        is_out = (val < low_out) or (val > high_out)
+    return df_out
 
-        # Zona alta (solo si no es extremo)
-        is_high = False
-        if not is_out and (val < low_high or val > high_high):
-            is_high = True
+def _construir_lut_dominios(dominios: dict) -> Tuple[Dict[str, int], int, np.ndarray]:
+    """
+    Tabla booleana [fila de variable, valor - mínimo] con los valores válidos
+    de cada variable categórica (dominios normalizados a enteros).
+    """
+    normalizados = {var: {int(v) for v in dom} for var, dom in dominios.items()}
+    todos = set().union(*normalizados.values())
+    minimo = min(todos) if todos else 0
+    maximo = max(todos) if todos else 0
 
-        return is_high, is_out
+    filas = {var: i for i, var in enumerate(normalizados)}
+    lut = np.zeros((len(normalizados), maximo - minimo + 1), dtype=bool)
+    for var, vals in normalizados.items():
+        lut[filas[var], [v - minimo for v in vals]] = True
+    return filas, minimo, lut
 
-    flags = df_vib.apply(_flags, axis=1, result_type="expand")
-    flags.columns = ["is_high_tmp", "is_outlier_tmp"]
 
-    df_out.loc[mask_vib, "is_high"] = flags["is_high_tmp"].values
-    df_out.loc[mask_vib, "is_outlier"] = flags["is_outlier_tmp"].values
+# Precalculado al importar: CATEGORICAL_DOMAINS es constante
+_DOMINIO_FILA, _DOMINIO_MIN, _DOMINIO_LUT = _construir_lut_dominios(CATEGORICAL_DOMAINS)
 
-    return df_out
 
-def mark_categorical_invalid(df: pd.DataFrame) -> pd.DataFrame:
+def mark_categorical_invalid(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """
     Marca valores categóricos fuera de dominio.
     Maneja correctamente valores como 0, 1, 0.0, 1.0, "1", "1.0", etc.
     """
-    df_out = df.copy()
+    df_out = df.copy() if copy else df
     df_out["is_invalid_category"] = False
 
-    mask_cat = df_out["variable"].isin(CATEGORICAL_VARS)
-    df_cat = df_out[mask_cat].copy()
-
-    if df_cat.empty:
+    mask_cat = df_out["variable"].isin(CATEGORICAL_VARS).to_numpy()
+    if not mask_cat.any():
         return df_out
 
+    df_cat = df_out.loc[mask_cat, ["variable", "valor"]]
+
     # Convertimos a numérico una sola vez (acepta "1", "1.0", 1, 1.0, etc.)
-    df_cat["valor_num"] = pd.to_numeric(df_cat["valor"], errors="coerce")
-
-    for var, group in df_cat.groupby("variable"):
-        raw_domain = CATEGORICAL_DOMAINS.get(var)
-        if raw_domain is None:
-            continue
-
-        # Normalizamos el dominio a enteros (por si vienen como strings)
-        valid_vals = {int(v) for v in raw_domain}
-
-        for idx, row in group.iterrows():
-            val_num = row["valor_num"]
-            if pd.isna(val_num):
-                # Missing se trata aparte, no como inválido de dominio
-                continue
-            try:
-                val_int = int(val_num)
-            except Exception:
-                df_out.at[idx, "is_invalid_category"] = True
-                continue
-
-            if val_int not in valid_vals:
-                df_out.at[idx, "is_invalid_category"] = True
+    valor_num = pd.to_numeric(df_cat["valor"], errors="coerce").to_numpy(
+        dtype=np.float64, na_value=np.nan
+    )
+
+    # Fila de la tabla de dominios de cada fila (-1: variable sin dominio)
+    codigos, nombres = pd.factorize(df_cat["variable"])
+    fila = np.array([_DOMINIO_FILA.get(n, -1) for n in nombres], dtype=np.intp)[codigos]
+
+    # Parte entera (como int()) y consulta directa en la tabla; lo que cae
+    # fuera del rango de la tabla (incluido ±inf) no es válido.
+    # Missing se trata aparte, no como inválido de dominio
+    val_int = np.trunc(valor_num)
+    en_rango = (val_int >= _DOMINIO_MIN) & (val_int < _DOMINIO_MIN + _DOMINIO_LUT.shape[1])
+    col = np.where(en_rango, val_int - _DOMINIO_MIN, 0).astype(np.intp)
+    valido = en_rango & _DOMINIO_LUT[np.maximum(fila, 0), col] if len(_DOMINIO_LUT) else en_rango
+
+    invalid = (fila >= 0) & ~np.isnan(valor_num) & ~valido
+
+    df_out.loc[mask_cat, "is_invalid_category"] = invalid
 
     return df_out
 
@@ -346,40 +413,98 @@ def mark_categorical_invalid(df: pd.DataFrame) -> pd.DataFrame:
 FLOAT_TOLERANCE = -1e-6 # Cualquier cambio que sea menor a -0.000001 se marca como error.
 
 
-def mark_accumulative_integrity(df: pd.DataFrame, accumulative_vars: list) -> pd.DataFrame:
+def mark_accumulative_integrity(df: pd.DataFrame, accumulative_vars: list, copy: bool = True) -> pd.DataFrame:
     """
     Detecta la caída de contadores (Código 6: Monotonicidad).
     Se aplica por variable para evitar comparar contadores diferentes.
     """
-    df_proc = df.copy()
-    df_proc['is_invalid_monotonic'] = False
-    
     # 1. ORDENAR CRÍTICAMENTE
     # Asegúrate de ordenar el DF por tiempo, que es la clave de la detección secuencial.
     # Asumimos que la columna de tiempo es 'ts_utc' o 'ts_utc_rounded' si ya lo has creado.
-    df_proc = df_proc.sort_values(by=['ts_utc', 'variable']) # Usar 'ts_utc' original si está antes de pivotar
+    # (sort_values ya devuelve una copia: no hace falta un df.copy() previo)
+    if copy:
+        df_proc = df.sort_values(by=['ts_utc', 'variable']) # Usar 'ts_utc' original si está antes de pivotar
+    else:
+        df_proc = df
+        df_proc.sort_values(by=['ts_utc', 'variable'], inplace=True)
 
-    # 2. APLICAR COMPARACIÓN POR GRUPO
-    # Esta es la forma más robusta de calcular el diferencial (diff) dentro de cada variable.
+    # 2. DETECTAR CAÍDAS POR VARIABLE (solo contadores)
+    vals = df_proc['valor'].to_numpy(dtype=np.float64, na_value=np.nan)
+    df_proc['is_invalid_monotonic'] = _caida_contadores(df_proc['variable'], vals, accumulative_vars)
     
-    # Crea una Serie booleana donde True = el valor actual es menor que el anterior
-    is_negative_change_series = df_proc.groupby('variable')['valor'].transform(
-        lambda x: x.diff() < FLOAT_TOLERANCE
-    )
+    return df_proc
+
+
+def _caida_contadores(variable: pd.Series, vals: np.ndarray, accumulative_vars: list) -> np.ndarray:
+    """
+    Máscara de caídas (delta < FLOAT_TOLERANCE) respecto a la lectura anterior
+    del mismo contador. Las filas deben venir ya en orden temporal.
+    """
+    flag = np.zeros(len(vals), dtype=bool)
 
-    # 3. FILTRAR SOLO LAS VARIABLES ACUMULATIVAS
     # Solo aplicamos la detección a las variables que están en la lista de contadores
-    is_accumulative = df_proc['variable'].isin(accumulative_vars)
-    
-    # 4. ASIGNAR EL FLAG
+    pos_acc = np.flatnonzero(variable.isin(accumulative_vars).to_numpy())
+    if pos_acc.size == 0:
+        return flag
+
+    # Orden estable por variable: cada contador queda contiguo y en orden temporal.
+    # Un único np.diff sobre todo el bloque; el primer valor de cada variable
+    # no se compara con el contador anterior (frontera de grupo).
+    codigos = pd.factorize(variable.to_numpy()[pos_acc])[0]
+    orden = np.argsort(codigos, kind='stable')
+    pos = pos_acc[orden]
+    codigos = codigos[orden]
+    v = vals[pos]
+
+    nuevo_grupo = np.r_[True, codigos[1:] != codigos[:-1]]
+    caida = np.r_[False, np.diff(v) < FLOAT_TOLERANCE] & ~nuevo_grupo
+
     # El flag se marca solo si la variable es acumulativa Y el cambio fue negativo
-    df_proc.loc[is_accumulative & is_negative_change_series, 'is_invalid_monotonic'] = True
-    
-    return df_proc
+    flag[pos[caida]] = True
+    return flag
+
+
+def mark_flags_basicos(df: pd.DataFrame, accumulative_vars: list, copy: bool = True) -> pd.DataFrame:
+    """
+    mark_missing + mark_invalid_physical + mark_accumulative_integrity en una
+    sola pasada: un único ordenamiento (que es también la única copia del DF)
+    y una única conversión de 'valor' a float para las tres banderas.
+
+    Devuelve el DF ordenado por (ts_utc, variable), como mark_accumulative_integrity.
+    """
+    if copy:
+        df_out = df.sort_values(by=['ts_utc', 'variable'])
+    else:
+        df_out = df
+        df_out.sort_values(by=['ts_utc', 'variable'], inplace=True)
+    vals = pd.to_numeric(df_out['valor'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+    df_out['is_missing'] = df_out['valor'].isna().to_numpy()
+    df_out['is_invalid_physical'] = df_out['variable'].isin(NUMERIC_VARS).to_numpy() & (vals < 0)
+    df_out['is_invalid_monotonic'] = _caida_contadores(df_out['variable'], vals, accumulative_vars)
+
+    return df_out
+
 
+def _std_movil(serie: np.ndarray, pos_en_grupo: np.ndarray, window: int) -> np.ndarray:
+    """
+    Desviación estándar muestral (ddof=1) de las últimas `window` lecturas de
+    cada fila, como rolling(window, min_periods=window).std() por variable:
+    NaN si la ventana no está completa dentro de su variable o contiene NaN.
+    Se calcula en dos pasadas por ventana, así que es más exacta que el
+    rolling().std() online de pandas: en ventanas cuya std cae justo en un
+    umbral (p. ej. [0, 0, 0, 3] -> 1.5) pandas puede dar 1.5000000000000004 y
+    marcar la fila, mientras que aquí sale 1.5 y no se marca.
+    """
+    std = np.full(len(serie), np.nan)
+    if len(serie) >= window:
+        ventanas = np.lib.stride_tricks.sliding_window_view(serie, window)
+        std[window - 1:] = ventanas.std(axis=1, ddof=1)
+    std[pos_en_grupo < window - 1] = np.nan
+    return std
 
 
-def mark_sequential_anomalies(df: pd.DataFrame) -> pd.DataFrame:
+def mark_sequential_anomalies(df: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """
     Marca las anomalías que requieren análisis de comportamiento a lo largo del tiempo:
     Salto Excesivo (8), Valor Constante (7) y Ruido Excesivo (10).
@@ -387,7 +512,7 @@ def mark_sequential_anomalies(df: pd.DataFrame) -> pd.DataFrame:
     @param df: DataFrame en formato largo con la columna 'valor' ya en float.
     @return: DataFrame con las nuevas columnas de flags.
     """
-    df_proc = df.copy()
+    df_proc = df.copy() if copy else df
 
     # Inicializar los nuevos flags a False
     df_proc['is_stuck_value'] = False
@@ -396,79 +521,72 @@ def mark_sequential_anomalies(df: pd.DataFrame) -> pd.DataFrame:
     
     # Lista de variables continuas que requieren esta detección
     continuous_vars = list(MAX_JUMP_THRESHOLD.keys())
-    
+
+    pos_cont = np.flatnonzero(df_proc['variable'].isin(continuous_vars).to_numpy())
+    if pos_cont.size == 0:
+        return df_proc
+
     # ----------------------------------------------------------------------
-    # A. Función de Detección Aplicada por Grupo (por variable)
+    # A. Todas las variables continuas en un solo array contiguo
     # ----------------------------------------------------------------------
-    
-    def apply_sequential_checks(series: pd.Series, var_name: str) -> pd.DataFrame:
-        """Aplica la detección secuencial a una única serie de una variable."""
-        
-        # DataFrame temporal para almacenar los flags de esta variable
-        flags = pd.DataFrame(index=series.index)
-        
-        # 1. Detección de Salto Excesivo (Código 8)
-        # -----------------------------------------------------------
-        # Calcula el cambio absoluto (Delta) entre el valor actual y el anterior.
-        delta_v = series.diff().abs()
-        
-        # Obtiene el umbral específico para esta variable
-        jump_threshold = MAX_JUMP_THRESHOLD.get(var_name, np.inf) 
-        
-        # Marca si el salto excede el umbral físico
-        flags['is_excessive_jump'] = delta_v > jump_threshold
+    # Orden estable por variable: cada serie queda en un bloque contiguo y
+    # conserva el orden de filas del DataFrame (el mismo que usaba el filtro
+    # por variable). Los chequeos se hacen en una pasada sobre todo el array,
+    # cuidando de no cruzar la frontera entre variables.
+    codigos, variables = pd.factorize(df_proc['variable'].to_numpy()[pos_cont])
+    orden = np.argsort(codigos, kind='stable')
+    pos = pos_cont[orden]
+    codigos = codigos[orden]
+    series = df_proc['valor'].to_numpy(dtype=np.float64, na_value=np.nan)[pos]
+
+    nuevo_grupo = np.r_[True, codigos[1:] != codigos[:-1]]
+    inicios = np.flatnonzero(nuevo_grupo)
+    pos_en_grupo = np.arange(len(pos)) - np.repeat(inicios, np.diff(np.r_[inicios, len(pos)]))
 
-        # 2. Detección de Valor Constante (Stuck Value) (Código 7)
-        # -----------------------------------------------------------
-        # Calcula la desviación estándar en una ventana deslizante de N periodos
-        # La ventana debe ser centrada o ajustada si se usa para el futuro (aquí usamos 'left').
-        
-        # Nota: Usamos la varianza o STD, si es cercana a cero.
-        # min_periods=STUCK_WINDOW_N asegura que solo se calcula cuando hay suficientes datos.
-        rolling_std = series.rolling(window=STUCK_WINDOW_N, min_periods=STUCK_WINDOW_N).std()
-        
-        # Marca si la STD es casi cero durante toda la ventana (y no es NaN/Missing)
-        # Se usa una máscara para aplicar el flag a toda la ventana una vez que la condición se cumple.
-        is_stuck = rolling_std < STUCK_VARIANCE_THRESHOLD
-        
-        # Se propaga la marca 'stuck' a lo largo de la ventana para una detección más robusta
-        flags['is_stuck_value'] = is_stuck.rolling(window=STUCK_WINDOW_N).max().fillna(False).astype(bool)
-
-        # 3. Detección de Ruido Excesivo (Código 10)
-        # -----------------------------------------------------------
-        # NOTA: Esta requiere un umbral estadístico (ej., 3xSTD histórica) que aún no tenemos
-        # calculado, pero la lógica de la ventana es similar al 'stuck value'.
-        # Por simplicidad inicial, usaremos un umbral arbitrario muy alto (DEBE SER REEMPLAZADO)
-        
-        rolling_noise_std = series.rolling(window=NOISE_WINDOW_N, min_periods=NOISE_WINDOW_N).std()
-        
-        # EJEMPLO ARBITRARIO: si la STD local es más de 10x la STD media global 
-        # (Esto debe venir de los stats calculados en la Fase 1)
-        # Reemplaza 'GLOBAL_STD_FOR_VAR' con la estadística que calcules.
-        GLOBAL_STD_FOR_VAR = 0.5 # Valor temporal de ejemplo
-        noise_threshold = GLOBAL_STD_FOR_VAR * NOISE_STD_MULTIPLIER
-        
-        flags['is_excessive_noise'] = rolling_noise_std > noise_threshold
-        
-        return flags
-    
     # ----------------------------------------------------------------------
-    # B. Aplicar la función de detección a todas las variables continuas
+    # B. Detección
     # ----------------------------------------------------------------------
-    
-    for var in continuous_vars:
-        # 1. Filtrar solo los datos de la variable actual
-        df_var = df_proc[df_proc['variable'] == var]
-        
-        # 2. Aplicar los chequeos secuenciales
-        # Nota: La función apply_sequential_checks necesita el nombre de la variable
-        results = apply_sequential_checks(df_var['valor'], var)
-        
-        # 3. Mapear los resultados de los flags de vuelta al DataFrame principal
-        # Las marcas se asignan solo a las filas que corresponden a esa variable
-        df_proc.loc[df_var.index, 'is_stuck_value'] = results['is_stuck_value']
-        df_proc.loc[df_var.index, 'is_excessive_jump'] = results['is_excessive_jump']
-        df_proc.loc[df_var.index, 'is_excessive_noise'] = results['is_excessive_noise']
+
+    # 1. Detección de Salto Excesivo (Código 8)
+    # Cambio absoluto (Delta) respecto al valor anterior de la misma variable,
+    # contra el umbral físico específico de cada variable.
+    delta_v = np.abs(np.r_[np.nan, np.diff(series)])
+    delta_v[nuevo_grupo] = np.nan
+    jump_threshold = np.array([MAX_JUMP_THRESHOLD.get(v, np.inf) for v in variables])[codigos]
+    is_jump = delta_v > jump_threshold
+
+    # 2. Detección de Valor Constante (Stuck Value) (Código 7)
+    # STD casi cero durante toda la ventana de N periodos (sin NaN/Missing).
+    is_stuck = _std_movil(series, pos_en_grupo, STUCK_WINDOW_N) < STUCK_VARIANCE_THRESHOLD
+
+    # Se propaga la marca 'stuck' a lo largo de la ventana para una detección más robusta
+    # (rolling(STUCK_WINDOW_N).max(): basta una marca en las últimas N lecturas)
+    stuck_prop = np.zeros(len(pos), dtype=bool)
+    if len(pos) >= STUCK_WINDOW_N:
+        stuck_prop[STUCK_WINDOW_N - 1:] = np.lib.stride_tricks.sliding_window_view(
+            is_stuck, STUCK_WINDOW_N
+        ).any(axis=1)
+    stuck_prop[pos_en_grupo < STUCK_WINDOW_N - 1] = False
+
+    # 3. Detección de Ruido Excesivo (Código 10)
+    # NOTA: Esta requiere un umbral estadístico (ej., 3xSTD histórica) que aún no tenemos
+    # calculado. Por simplicidad inicial, usaremos un umbral arbitrario (DEBE SER REEMPLAZADO)
+    # Reemplaza 'GLOBAL_STD_FOR_VAR' con la estadística que calcules en la Fase 1.
+    GLOBAL_STD_FOR_VAR = 0.5 # Valor temporal de ejemplo
+    noise_threshold = GLOBAL_STD_FOR_VAR * NOISE_STD_MULTIPLIER
+    is_noise = _std_movil(series, pos_en_grupo, NOISE_WINDOW_N) > noise_threshold
+
+    # ----------------------------------------------------------------------
+    # C. Mapear los flags de vuelta a las filas del DataFrame principal
+    # ----------------------------------------------------------------------
+    for col, flags in (
+        ('is_stuck_value', stuck_prop),
+        ('is_excessive_jump', is_jump),
+        ('is_excessive_noise', is_noise),
+    ):
+        flag = np.zeros(len(df_proc), dtype=bool)
+        flag[pos] = flags
+        df_proc[col] = flag
 
     return df_proc
 
@@ -506,18 +624,43 @@ def compute_quality_code(row: pd.Series) -> int:
     return 0      # OK
 
 
-def _clean_outliers_and_prepare(df: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFrame:
+# Misma jerarquía que compute_quality_code (de más a menos severo)
+_JERARQUIA_DETECCION = [
+    ("is_invalid_monotonic", 6),
+    ("is_invalid_physical", 5),
+    ("is_invalid_category", 4),
+    ("is_outlier", 3),
+    ("is_gap", 2),
+    ("is_missing", 1),
+]
+
+
+def _quality_code_deteccion(df: pd.DataFrame) -> np.ndarray:
+    """
+    Versión vectorizada de compute_quality_code: un solo np.select sobre
+    todas las filas. Las banderas que no existan cuentan como False.
+    """
+    conditions = [
+        df[col].to_numpy().astype(bool) if col in df.columns else np.zeros(len(df), dtype=bool)
+        for col, _ in _JERARQUIA_DETECCION
+    ]
+    choices = [code for _, code in _JERARQUIA_DETECCION]
+    return np.select(conditions, choices, default=0)
+
+
+def _clean_outliers_and_prepare(df: pd.DataFrame, stats: pd.DataFrame, copy: bool = True) -> pd.DataFrame:
     """
     1. Marca outliers.
     2. Reemplaza outliers extremos (is_outlier=True) con NaN para futura imputación.
     """
     # 1. Marcar outliers y high (usa la lógica de mark_vibration_outliers)
-    df_out = mark_vibration_outliers(df, stats)
+    df_out = mark_vibration_outliers(df, stats, copy=copy)
     
     # 2. Reemplazar outliers extremos (3*IQR) por NaN para que sean imputados
     # Aplicamos esto solo a las filas que fueron marcadas como 'is_outlier'
     logging.info("-> Reemplazando outliers extremos (is_outlier=True) por NaN para imputación.")
-    df_out.loc[df_out["is_outlier"], "valor"] = pd.NA # Usar pd.NA para tipo compatible con NaNs
+    # np.nan (no pd.NA): 'valor' sigue siendo un float nativo de NumPy
+    df_out.loc[df_out["is_outlier"].to_numpy(), "valor"] = np.nan
 
     return df_out
 
@@ -528,40 +671,49 @@ def limpiar_por_variable_deteccion(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.D
     - Reemplaza outliers extremos por NaN.
     - NO hace imputación ni remuestreo.
     """
-    df_proc = df.copy()
-
-    # 🚨 CORRECCIÓN CLAVE: Convertir 'valor' a float. Los valores categóricos
-    # que no puedan ser convertidos a número (como "ON", "OFF", si los hubiera)
-    # se harán NaN, lo cual debe ser manejado por las banderas subsiguientes.
-    df_proc["valor"] = pd.to_numeric(df_proc["valor"], errors="coerce")
-
-    # Aseguramos orden temporal (requerido para acumulativas)
-    if "ts_utc" in df_proc.columns:
-        df_proc = df_proc.sort_values("ts_utc")
-        
-    # 1) Missing (Ahora incluye los NaNs originales + NaNs por conversión fallida)
-    df_proc = mark_missing(df_proc)
+    # Única copia del pipeline: los mark_* siguientes marcan sobre df_proc
+    # (copy=False). Las banderas se crean juntas desde el inicio, en su orden.
+    df_proc = df.assign(
+        # 🚨 CORRECCIÓN CLAVE: Convertir 'valor' a float. Los valores categóricos
+        # que no puedan ser convertidos a número (como "ON", "OFF", si los hubiera)
+        # se harán NaN, lo cual debe ser manejado por las banderas subsiguientes.
+        valor=pd.to_numeric(df["valor"], errors="coerce"),
+        # 'variable' como category una sola vez: los isin/groupby/sort por variable
+        # de los mark_* trabajan sobre códigos enteros en vez de hashear strings.
+        # ('valor' se mantiene en float64: se persiste tal cual y las tolerancias
+        # de 1e-6 quedan por debajo de la resolución de float32 en los contadores)
+        variable=df["variable"].astype("category"),
+        is_missing=False,
+        is_invalid_physical=False,
+        is_high=False,
+        is_outlier=False,
+        is_invalid_category=False,
+        is_invalid_monotonic=False,
+    )
 
-    # 2) Valores físicamente imposibles
-    df_proc = mark_invalid_physical(df_proc) # ⚠️ Nota: Esta función ya asume que 'valor' es numérico.
+    # 1-2) Missing (NaNs originales + NaNs por conversión fallida), valores
+    # físicamente imposibles e integridad de contadores, en una sola pasada.
+    # Deja el DF en orden temporal (ts_utc, variable), requerido para acumulativas.
+    # (Los contadores no se ven afectados por el reemplazo de outliers de vibración.)
+    mark_flags_basicos(df_proc, ACCUMULATIVE_VARS, copy=False)
 
     # 3) Estadísticos para vibración
     stats_vib = compute_vibration_stats(df_proc) # ⚠️ Nota: Esta función ya asume que 'valor' es numérico.
 
     # 4) Outliers, valores altos Y REEMPLAZO DE OUTLIERS por NaN
-    df_proc = _clean_outliers_and_prepare(df_proc, stats_vib)
+    _clean_outliers_and_prepare(df_proc, stats_vib, copy=False)
 
     # 5) Categóricas fuera de dominio
     # ⚠️ Esta función también debe manejar la columna 'valor' que ya es float (NaN si era texto).
-    df_proc = mark_categorical_invalid(df_proc)
-
-    # 6) Integridad de contadores
-    df_proc = mark_accumulative_integrity(df_proc,ACCUMULATIVE_VARS)
+    mark_categorical_invalid(df_proc, copy=False)
 
     # ... (Aseguramos que flags existan) ...
 
-    # 7) Quality code
-    df_proc["quality_code"] = df_proc.apply(compute_quality_code, axis=1)
+    # 6) Quality code
+    df_proc["quality_code"] = _quality_code_deteccion(df_proc)
+
+    # 'variable' vuelve a su dtype de entrada (category solo era interno)
+    df_proc["variable"] = df_proc["variable"].astype(df["variable"].dtype)
 
     # 🚨 NOTA: df_proc contiene los outliers reemplazados por NaN y el quality_code
     return df_proc, stats_vib
\ No newline at end of file
@@ -1,5 +1,19 @@
 import requests
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson (opcional): codifica JSON bastante más rápido que el json estándar
+try:
+    import orjson
+
+    def json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:  # sin orjson: json estándar
+    import json
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
 
 # ===========================
 # Configuración API RESFULL
@@ -30,7 +44,25 @@ BASIC_USER   = ""
 BASIC_PASS   = ""
 X_API_KEY    = "zxcvbnm"
 
+# Pool de conexiones keep-alive compartido (también entre hilos).
+# Los reintentos del adapter solo aplican a métodos idempotentes (GET);
+# los POST se reintentan explícitamente en load_metrics_quality / load_features.
+POOL_SIZE = 32
+# Hilos de envío de los cargadores; nunca más que conexiones en el pool
+# (así ningún hilo abre conexiones extra que luego se descartan)
+MAX_WORKERS = min(16, POOL_SIZE)
+
 session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=POOL_SIZE,
+    pool_maxsize=POOL_SIZE,
+    # Sin bloqueo: si el pool está lleno se abre una conexión extra en vez de
+    # esperar sin límite a que otra se libere (requests no tiene timeout de pool)
+    pool_block=False,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+)
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
 headers = {}
 auth = None
 
@@ -41,6 +73,9 @@ elif AUTH_MODE == "basic" and BASIC_USER:
 elif AUTH_MODE == "x-api-key" and X_API_KEY:
     headers["x-api-key"] = X_API_KEY
 
+# Cabeceras para POST con cuerpo ya serializado (data=json_dumps(...))
+json_headers = {**headers, "Content-Type": "application/json"}
+
 # ===========================
 # Carpetas de salida (por si las necesitas)
 # ===========================
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from typing import Tuple, Dict, List
 
@@ -27,21 +28,32 @@ def limpiar_duplicados_raw(
         print("DataFrame vacío, no hay duplicados que limpiar.")
         return df
 
-    # Identificar filas duplicadas
-    dups_mask = df.duplicated(subset=key_cols, keep=False)
-    
+    # Un solo hash de la clave: código entero de grupo por fila
+    # (observed=True: con claves categóricas, solo combinaciones presentes)
+    codes = df.groupby(key_cols, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    n = len(codes)
+    tamanos = np.bincount(codes)
+
     # Contar duplicados
-    num_dups = dups_mask.sum()
-    num_a_eliminar = dups_mask.sum() - df[dups_mask].duplicated(subset=key_cols, keep='last').sum()
+    num_dups = int((tamanos[codes] > 1).sum())
+    num_a_eliminar = n - len(tamanos)
 
     if num_dups > 0:
         print(f"✅ Se encontraron {num_dups} registros que forman parte de un duplicado.")
         print(f"🗑️ Se eliminarán {num_a_eliminar} registros duplicados (conservando el último).")
     else:
         print("✅ No se encontraron registros duplicados.")
-    
-    # Eliminar duplicados, manteniendo el ÚLTIMO
-    df_clean = df.drop_duplicates(subset=key_cols, keep='last').reset_index(drop=True)
+
+    if num_a_eliminar == 0:
+        return df.reset_index(drop=True)
+
+    # Eliminar duplicados, manteniendo el ÚLTIMO de cada grupo (en orden original):
+    # posición máxima por código en una pasada (sin ordenar ni volver a hashear)
+    ultima_pos = np.full(len(tamanos), -1, dtype=np.int64)
+    np.maximum.at(ultima_pos, codes, np.arange(n))
+    keep = np.zeros(n, dtype=bool)
+    keep[ultima_pos] = True
+    df_clean = df.iloc[np.flatnonzero(keep)].reset_index(drop=True)
     
     return df_clean
 
@@ -69,11 +81,10 @@ def sincronizar_y_pivotar_datos(
         print("DataFrame vacío, retornando DataFrame vacío en formato ancho.")
         return pd.DataFrame()
     
-    df = df.copy()
-    
     # 1. Redondear el timestamp para sincronizar
     # Redondea ts_utc al múltiplo más cercano de la frecuencia
-    df["ts_rounded"] = df[time_col].dt.round(freq=freq)
+    # (como Series aparte: sin copiar df para añadirle una columna)
+    ts_rounded = df[time_col].dt.round(freq=freq).rename("ts_rounded")
     
     print(f"🔄 Timestamps redondeados a la frecuencia: **{freq}**")
 
@@ -81,28 +92,31 @@ def sincronizar_y_pivotar_datos(
     # Las columnas clave + el timestamp redondeado formarán el nuevo índice.
     # 'variable' serán las nuevas columnas.
     # 'valor' serán los datos.
+    # Un groupby + unstack directo equivale a pivot_table sin su sobrecoste
+    # (despacho genérico de la agregación, márgenes, etc.).
+    grouped = df.groupby(key_cols + [ts_rounded, variable_col], sort=True, observed=True)[value_col]
     
     try:
         # Se asegura de que solo haya un valor por (key_cols, ts_rounded, variable)
-        df_pivot = df.pivot_table(
-            index=key_cols + ["ts_rounded"],
-            columns=variable_col,
-            values=value_col,
-            aggfunc='first' # En caso de que queden duplicados EXACTOS, toma el primer valor.
-        ).reset_index()
+        # En caso de que queden duplicados EXACTOS, toma el primer valor (no nulo).
+        agged = grouped.first()
         
-    except ValueError as e:
+    except (TypeError, ValueError) as e:
         # Esto ocurre si después del redondeo y el 'drop_duplicates' en el paso 1,
         # quedan múltiples valores para la misma celda (ts_rounded, variable).
         print(f"⚠️ Error al pivotar. Podría haber múltiples valores para la misma celda después del redondeo: {e}")
-        # Intentar una agregación por la media si pivot_table falla
+        # Intentar una agregación por la media si 'first' falla
         print("Intentando agregar por la media...")
-        df_pivot = df.pivot_table(
-            index=key_cols + ["ts_rounded"],
-            columns=variable_col,
-            values=value_col,
-            aggfunc='mean' # Agregamos promediando si hay conflicto
-        ).reset_index()
+        agged = grouped.mean() # Agregamos promediando si hay conflicto
+
+    # Como pivot_table (dropna=True): sin celdas, filas ni columnas vacías
+    df_pivot = (
+        agged.dropna()
+        .unstack(variable_col)
+        .dropna(how="all", axis=1)
+        .sort_index(axis=1)
+        .reset_index()
+    )
 
     # 3. Renombrar la columna de tiempo y establecer el índice
     df_pivot = df_pivot.rename(columns={"ts_rounded": time_col})
@@ -202,18 +216,23 @@ def agregar_flags_temporales(
     if df_sorted.empty:
         return df_sorted.copy()
 
-    df = df_sorted.copy()
+    # Copia superficial: solo se añaden columnas nuevas (df_sorted no las ve),
+    # sin duplicar sus datos. Las columnas existentes se comparten: quien
+    # necesite modificarlas in situ debe copiar antes (limpiar_* ya lo hace).
+    df = df_sorted.copy(deep=False)
     gaps_idx = df_gaps.set_index("ts_utc")
 
-    df["delta_s"] = df["ts_utc"].map(gaps_idx["delta_s"])
-    df["is_gap"] = df["ts_utc"].map(gaps_idx["is_gap"]).fillna(False)
+    # Una sola búsqueda de cada ts_utc en el índice de gaps (en vez de un map
+    # por columna); la posición extra final cubre los no encontrados (-1)
+    pos = gaps_idx.index.get_indexer(df["ts_utc"])
+    delta = np.append(gaps_idx["delta_s"].to_numpy(dtype=float), np.nan)[pos]
+    is_gap = np.append(gaps_idx["is_gap"].to_numpy(dtype=bool), False)[pos]
 
     small_delta_max = expected_sec * small_delta_factor
 
-    df["is_small_delta"] = (
-        df["delta_s"].notna()
-        & (df["delta_s"] > 0)
-        & (df["delta_s"] < small_delta_max)
-    )
+    df["delta_s"] = delta
+    df["is_gap"] = is_gap
+    # NaN compara como False: no hace falta un notna() aparte
+    df["is_small_delta"] = (delta > 0) & (delta < small_delta_max)
 
     return df
@@ -1,14 +1,84 @@
 import numpy as np
 import pandas as pd
-from typing import List
 from conf import MAIN_SIGNAL_VAR, FEATURE_WINDOW_S, MIN_SAMPLES_PER_WINDOW
 
+# Características por ventana, en el orden en que se emiten
+CARACTERISTICAS = [
+    "mean", "std", "min", "max", "rms_window", "count_samples",
+    "fft_peak_amp", "fft_peak_bin", "fft_energy_total",
+]
 
-def _rms(x: np.ndarray) -> float:
-    """Calcula RMS de un vector NumPy."""
-    if x.size == 0:
-        return np.nan
-    return float(np.sqrt(np.mean(x ** 2)))
+
+def _estadisticos_por_ventana(vals: np.ndarray, inicios: np.ndarray) -> dict:
+    """
+    Estadísticos en dominio del tiempo de cada ventana, en una pasada por
+    estadístico sobre el array plano (reduceat por tramos, sin groupby).
+
+    vals: valores de todas las ventanas, contiguos y en orden de ventana.
+    inicios: posición en vals donde empieza cada ventana (creciente, sin vacías).
+    Devuelve un dict de arrays: mean, std, min, max, rms_window, count.
+    """
+    conteos = np.diff(np.append(inicios, len(vals)))
+    if not len(inicios):
+        vacio = np.array([], dtype=float)
+        return {"mean": vacio, "std": vacio, "min": vacio, "max": vacio,
+                "rms_window": vacio, "count": conteos}
+
+    media = np.add.reduceat(vals, inicios) / conteos
+
+    # Desviación estándar muestral (ddof=1) en dos pasadas: sumando los
+    # cuadrados de las desviaciones respecto a la media (estable numéricamente).
+    # Con una sola muestra la desviación es 0 (no NaN)
+    desvio = vals - np.repeat(media, conteos)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.sqrt(np.add.reduceat(desvio ** 2, inicios) / (conteos - 1))
+    std[conteos == 1] = 0.0
+
+    return {
+        "mean": media,
+        "std": std,
+        "min": np.minimum.reduceat(vals, inicios),
+        "max": np.maximum.reduceat(vals, inicios),
+        "rms_window": np.sqrt(np.add.reduceat(vals ** 2, inicios) / conteos),
+        "count": conteos,
+    }
+
+
+def _espectro_por_ventana(vals: np.ndarray, inicios: np.ndarray, conteos: np.ndarray) -> tuple:
+    """
+    Pico y energía del espectro (FFT real) de cada ventana.
+
+    vals: valores de todas las ventanas, contiguos y en orden de ventana.
+    inicios / conteos: posición en vals y número de valores de cada ventana.
+    Devuelve tres arrays (amplitud del pico, bin del pico, energía total).
+
+    Las ventanas con el mismo número de muestras se apilan en una matriz y
+    se transforman con una sola llamada a rfft (sin rellenar con ceros, que
+    cambiaría los bins del espectro).
+    """
+    peak_amp = np.zeros(len(conteos))
+    peak_bin = np.zeros(len(conteos))
+    energia = np.zeros(len(conteos))
+
+    for n in np.unique(conteos):
+        filas = np.flatnonzero(conteos == n)
+        matriz = vals[inicios[filas, None] + np.arange(n)]
+
+        # Quitamos la media antes de FFT para centrado
+        matriz -= matriz.mean(axis=1, keepdims=True)
+        fft_amp = np.abs(np.fft.rfft(matriz, axis=1))
+
+        # Ignoramos bin 0 (DC) y buscamos pico en el resto
+        if fft_amp.shape[1] > 1:
+            pico = np.argmax(fft_amp[:, 1:], axis=1) + 1
+        else:
+            pico = np.zeros(len(filas), dtype=np.int64)
+
+        peak_amp[filas] = fft_amp[np.arange(len(filas)), pico]
+        peak_bin[filas] = pico
+        energia[filas] = np.sum(fft_amp ** 2, axis=1)
+
+    return peak_amp, peak_bin, energia
 
 
 def generar_caracteristicas_despliegue(
@@ -42,11 +112,9 @@ def generar_caracteristicas_despliegue(
             "caracteristica", "valor", "ventana_s", "indicador_calidad"
         ])
 
-    # Aseguramos orden temporal
-    df = df_limpio.sort_values("ts_utc").copy()
-
     # Tomamos solo la variable principal para las features
-    df_sig = df[df["variable"] == MAIN_SIGNAL_VAR].copy()
+    # (se filtra antes de ordenar: solo se ordenan sus filas)
+    df_sig = df_limpio[df_limpio["variable"] == MAIN_SIGNAL_VAR]
     if df_sig.empty:
         # No hay esa variable en el despliegue
         return pd.DataFrame(columns=[
@@ -54,8 +122,9 @@ def generar_caracteristicas_despliegue(
             "caracteristica", "valor", "ventana_s", "indicador_calidad"
         ])
 
-    # Aseguramos tipo numérico
-    df_sig["valor"] = pd.to_numeric(df_sig["valor"], errors="coerce")
+    # Aseguramos orden temporal y tipo numérico
+    df_sig = df_sig.sort_values("ts_utc", kind="stable")
+    df_sig = df_sig.assign(valor=pd.to_numeric(df_sig["valor"], errors="coerce"))
 
     # Extraemos despliegue_id (asumimos homogéneo en el df)
     despliegue_id = df_sig["despliegue_id"].iloc[0]
@@ -64,112 +133,73 @@ def generar_caracteristicas_despliegue(
     t_min = df_sig["ts_utc"].min()
     t_max = df_sig["ts_utc"].max()
 
-    # Listado donde iremos guardando dicts con las características
-    rows: List[dict] = []
-
-    # Iteramos ventanas sin solapamiento
-    ventana_inicio = t_min
-
-    while ventana_inicio < t_max:
-        ventana_fin = ventana_inicio + pd.Timedelta(seconds=ventana_s)
-
-        # Filtramos mediciones de la variable principal dentro de la ventana
-        mask_win = (df_sig["ts_utc"] >= ventana_inicio) & (df_sig["ts_utc"] < ventana_fin)
-        df_win = df_sig[mask_win].copy()
-
-        if df_win.empty:
-            # Avanzamos a la siguiente ventana
-            ventana_inicio = ventana_fin
-            continue
-
-        # Si tenemos columna is_gap y hay un gap dentro de la ventana, opcionalmente descartamos
-        if "is_gap" in df_win.columns and df_win["is_gap"].any():
-            # Podrías optar por saltar la ventana
-            ventana_inicio = ventana_fin
-            continue
-
-        # Separamos valores limpios (quality_code == 0)
-        df_good = df_win[df_win["quality_code"] == 0].copy()
-        df_good = df_good.dropna(subset=["valor"])
-
-        if len(df_good) < min_samples:
-            # Muy pocos datos confiables, descartamos la ventana
-            ventana_inicio = ventana_fin
-            continue
-
-        # Vector de valores numéricos para estadísticas y FFT
-        vals = df_good["valor"].to_numpy(dtype=float)
-
-        # -------------------------
-        # Estadísticos en dominio del tiempo
-        # -------------------------
-        mean_val = float(np.mean(vals))
-        std_val = float(np.std(vals, ddof=1)) if len(vals) > 1 else 0.0
-        min_val = float(np.min(vals))
-        max_val = float(np.max(vals))
-        rms_val = _rms(vals)
-        count_samples = int(len(vals))
-
-        # -------------------------
-        # Espectro (FFT) en dominio de la frecuencia
-        # -------------------------
-        # Podemos quitar la media antes de FFT para centrado
-        vals_detrended = vals - mean_val
-
-        # FFT real (solo parte positiva)
-        fft_complex = np.fft.rfft(vals_detrended)
-        fft_amp = np.abs(fft_complex)
-
-        # Evitar que la componente DC (índice 0) domine, si quieres podemos ignorarla
-        if fft_amp.size > 1:
-            # Ignoramos bin 0 (DC) y buscamos pico en el resto
-            peak_idx_rel = int(np.argmax(fft_amp[1:]) + 1)
-        else:
-            peak_idx_rel = 0
-
-        fft_peak_amp = float(fft_amp[peak_idx_rel]) if fft_amp.size > 0 else 0.0
-        fft_energy_total = float(np.sum(fft_amp ** 2))
-
-        # -------------------------
-        # Indicador de calidad de la ventana
-        # Máximo quality_code (todas las mediciones de la variable en la ventana)
-        # -------------------------
-        qc_window = int(df_win["quality_code"].max()) if "quality_code" in df_win.columns else 0
-
-        # Timestamp de referencia de la ventana (usamos el fin de la ventana
-        # o el último ts_utc disponible dentro de la ventana)
-        ts_ref = df_win["ts_utc"].max()
-
-        base_info = {
-            "ts_utc": ts_ref,
-            "variable": MAIN_SIGNAL_VAR,
-            "ventana_s": ventana_s,
-            "indicador_calidad": qc_window,
-             "despliegue_id": despliegue_id,
-
-        }
-
-        # Agregamos filas para cada característica
-        rows.extend([
-            {**base_info, "caracteristica": "mean",           "valor": mean_val},
-            {**base_info, "caracteristica": "std",            "valor": std_val},
-            {**base_info, "caracteristica": "min",            "valor": min_val},
-            {**base_info, "caracteristica": "max",            "valor": max_val},
-            {**base_info, "caracteristica": "rms_window",     "valor": rms_val},
-            {**base_info, "caracteristica": "count_samples",  "valor": float(count_samples)},
-            {**base_info, "caracteristica": "fft_peak_amp",   "valor": fft_peak_amp},
-            {**base_info, "caracteristica": "fft_peak_bin",   "valor": float(peak_idx_rel)},
-            {**base_info, "caracteristica": "fft_energy_total","valor": fft_energy_total},
-        ])
-
-        # Avanzamos a la siguiente ventana
-        ventana_inicio = ventana_fin
-
-    if not rows:
+    # Ventanas sin solapamiento desde t_min: cada fila recibe el índice de su
+    # ventana. Solo cuentan las ventanas que empiezan antes de t_max.
+    desde_inicio = (df_sig["ts_utc"] - t_min).to_numpy()
+    ancho = np.timedelta64(ventana_s, "s")
+    en_rango = ~np.isnat(desde_inicio)
+    ventana = np.zeros(len(df_sig), dtype=np.int64)
+    ventana[en_rango] = desde_inicio[en_rango] // ancho
+    en_rango &= ventana * ancho < (t_max - t_min).to_timedelta64()
+    df_ven = df_sig[en_rango].assign(ventana=ventana[en_rango])
+
+    # Una sola pasada agrupada por ventana (todas las mediciones de la variable):
+    #   - timestamp de referencia: último ts_utc de la ventana
+    #   - indicador de calidad: máximo quality_code de la ventana
+    por_ventana = df_ven.groupby("ventana", sort=True)
+    resumen = por_ventana.agg(ts_utc=("ts_utc", "max"), indicador_calidad=("quality_code", "max"))
+
+    # Si tenemos columna is_gap, descartamos las ventanas con algún gap
+    if "is_gap" in df_ven.columns:
+        resumen = resumen[~por_ventana["is_gap"].any().astype(bool)]
+
+    # Valores limpios (quality_code == 0) para estadísticas y FFT
+    # (df_ven ya está ordenado por tiempo: cada ventana es un tramo contiguo)
+    limpio = (df_ven["quality_code"] == 0).to_numpy() & df_ven["valor"].notna().to_numpy()
+    vals = df_ven["valor"].to_numpy(dtype=float)[limpio]
+    ventana_vals = df_ven["ventana"].to_numpy()[limpio]
+    inicios = np.flatnonzero(np.diff(ventana_vals, prepend=-1))
+
+    # -------------------------
+    # Estadísticos en dominio del tiempo
+    # -------------------------
+    stats = pd.DataFrame(
+        _estadisticos_por_ventana(vals, inicios),
+        index=pd.Index(ventana_vals[inicios], name="ventana"),
+    )
+    stats["inicio"] = inicios
+
+    # Descartamos ventanas con muy pocos datos confiables
+    stats = stats[stats["count"] >= min_samples].join(resumen, how="inner")
+
+    if stats.empty:
         return pd.DataFrame(columns=[
             "ts_utc", "variable",
             "caracteristica", "valor", "ventana_s", "indicador_calidad", "despliegue_id", 
         ])
 
-    df_feats = pd.DataFrame(rows)
+    # -------------------------
+    # Espectro (FFT) en dominio de la frecuencia
+    # -------------------------
+    stats["fft_peak_amp"], stats["fft_peak_bin"], stats["fft_energy_total"] = _espectro_por_ventana(
+        vals, stats["inicio"].to_numpy(), stats["count"].to_numpy()
+    )
+
+    # Formato largo: una fila por (ventana, característica), en el orden de
+    # siempre. Se construye directamente desde arrays por columna: la matriz
+    # (ventanas x características) aplanada por filas da los valores, y el
+    # resto se repite por ventana o es escalar.
+    stats["count_samples"] = stats["count"].astype(float)
+    n_car = len(CARACTERISTICAS)
+
+    df_feats = pd.DataFrame({
+        "ts_utc": stats["ts_utc"].array.repeat(n_car),
+        "variable": MAIN_SIGNAL_VAR,
+        "ventana_s": ventana_s,
+        "indicador_calidad": stats["indicador_calidad"].to_numpy().astype(int).repeat(n_car),
+        "despliegue_id": despliegue_id,
+        "caracteristica": np.tile(np.array(CARACTERISTICAS, dtype=object), len(stats)),
+        "valor": stats[CARACTERISTICAS].to_numpy(dtype=float).ravel(),
+    })
+
     return df_feats
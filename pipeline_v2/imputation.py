@@ -1,4 +1,5 @@
 # imputation.py
+import numpy as np
 import pandas as pd
 import logging
 from typing import Dict, Tuple
@@ -13,6 +14,76 @@ from conf import (
 # Creamos un mapeo inverso para trabajar con los nombres limpios (snake_case)
 INV_METRICS_MAP = {v: k for k, v in METRICS_MAP.items()}
 
+
+def _vecinos_validos(validos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Para cada celda de una matriz (filas = tiempo), fila del último valor
+    válido anterior o igual (-1 si no hay) y del siguiente posterior o igual
+    (n si no hay). Todas las columnas a la vez, con acumulados por columna.
+    """
+    n = validos.shape[0]
+    filas = np.arange(n)[:, None]
+    anterior = np.maximum.accumulate(np.where(validos, filas, -1), axis=0)
+    siguiente = np.minimum.accumulate(np.where(validos, filas, n)[::-1], axis=0)[::-1]
+    return anterior, siguiente
+
+
+def _interpolar_lineal(arr: np.ndarray, limit: int) -> None:
+    """
+    Interpolación lineal in situ por columnas de una matriz float, equivalente a
+    DataFrame.interpolate(method='linear', limit=limit, limit_direction='both'):
+    un NaN se rellena si está a <= limit posiciones de un valor válido por
+    cualquiera de los dos lados; en los extremos se repite el valor válido más
+    cercano (como np.interp). Columnas sin valores válidos quedan igual.
+    """
+    validos = ~np.isnan(arr)
+    anterior, siguiente = _vecinos_validos(validos)
+    n = arr.shape[0]
+    filas = np.arange(n)[:, None]
+
+    hay_ant = anterior >= 0
+    hay_sig = siguiente < n
+    rellenar = ~validos & (
+        (hay_ant & (filas - anterior <= limit)) | (hay_sig & (siguiente - filas <= limit))
+    )
+    if not rellenar.any():
+        return
+
+    fila, col = np.nonzero(rellenar)
+    ant = anterior[fila, col]
+    sig = siguiente[fila, col]
+    # Sin vecino por un lado se usa el del otro (valor constante en el extremo)
+    ant_ok = np.where(ant >= 0, ant, sig)
+    sig_ok = np.where(sig < n, sig, ant)
+    y_ant = arr[ant_ok, col]
+    y_sig = arr[sig_ok, col]
+
+    # Misma fórmula que np.interp: pendiente * (x - x0) + y0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pendiente = (y_sig - y_ant) / (sig_ok - ant_ok)
+        valor = np.where(sig_ok == ant_ok, y_ant, pendiente * (fila - ant_ok) + y_ant)
+    arr[fila, col] = valor
+
+
+def _ffill_bfill(arr: np.ndarray, limit: int) -> None:
+    """
+    Relleno in situ por columnas de una matriz float, equivalente a
+    DataFrame.ffill(limit=limit).bfill(limit=limit): primero el último valor
+    válido (a <= limit posiciones) y, si no alcanza, el siguiente.
+    """
+    validos = ~np.isnan(arr)
+    anterior, siguiente = _vecinos_validos(validos)
+    n = arr.shape[0]
+    filas = np.arange(n)[:, None]
+
+    hacia_adelante = ~validos & (anterior >= 0) & (filas - anterior <= limit)
+    hacia_atras = ~validos & ~hacia_adelante & (siguiente < n) & (siguiente - filas <= limit)
+
+    fila, col = np.nonzero(hacia_adelante)
+    arr[fila, col] = arr[anterior[fila, col], col]
+    fila, col = np.nonzero(hacia_atras)
+    arr[fila, col] = arr[siguiente[fila, col], col]
+
 def impute_by_group(df_ancho: pd.DataFrame) -> pd.DataFrame:
     """
     Aplica imputación específica por grupo de variables al DataFrame Ancho (Uniforme).
@@ -20,8 +91,6 @@ def impute_by_group(df_ancho: pd.DataFrame) -> pd.DataFrame:
     @param df_ancho: DataFrame en Formato Ancho y remuestreado (con NaNs).
     @return: DataFrame limpio con imputaciones.
     """
-    df_imputado = df_ancho.copy()
-    
     # 1. Identificar las columnas por tipo (usando nombres limpios)
     def get_clean_vars(raw_vars):
         return [METRICS_MAP[k] for k in raw_vars if k in METRICS_MAP]
@@ -30,24 +99,35 @@ def impute_by_group(df_ancho: pd.DataFrame) -> pd.DataFrame:
     cat_acc_vars = get_clean_vars(CATEGORICAL_VARS + ACCUMULATIVE_VARS)
     
     # Aseguramos que solo trabajamos con columnas que existen en el DF
-    vib_phys_vars = [c for c in vib_phys_vars if c in df_imputado.columns]
-    cat_acc_vars = [c for c in cat_acc_vars if c in df_imputado.columns]
+    vib_phys_vars = [c for c in vib_phys_vars if c in df_ancho.columns]
+    cat_acc_vars = [c for c in cat_acc_vars if c in df_ancho.columns]
 
     # 2. Agregar bandera de imputación antes de imputar
-    # Creamos una columna temporal para marcar dónde había NaN antes de la imputación.
+    # Marcamos dónde había NaN antes de la imputación, solo en las columnas
+    # que se imputan (en el resto la bandera es siempre False).
     # Esta bandera captura gaps pequeños y outliers (si ya se reemplazaron por NaN).
-    imputation_mask = df_imputado.isna().copy()
+    n_filas = len(df_ancho)
+    sin_imputar = np.zeros(n_filas, dtype=bool)
+
+    # Sin copiar df_ancho entero: cada grupo produce sus columnas imputadas
+    # (sobre una copia float de su matriz) y el DataFrame final se construye
+    # una sola vez. df_ancho no se modifica.
+    columnas_imputadas = {}
+    banderas = {}
 
     # 3. Imputación de Continuas (Vibración y Físicas)
     if vib_phys_vars:
         logging.info("-> Imputando Continuas (Vibración/Físicas) con Interpolación Lineal...")
         # 🚨 CORRECCIÓN: Quitamos el bucle de pd.to_numeric. La columna ya debe ser float
         # debido a la corrección en 'limpiar_por_variable_deteccion'.
-        df_imputado[vib_phys_vars] = df_imputado[vib_phys_vars].interpolate(
-            method='linear', 
-            limit=IMPUTATION_LIMIT_N,
-            limit_direction='both'
-        )
+        # Interpolación en NumPy sobre la matriz del grupo (una copia float),
+        # sin el DataFrame intermedio de interpolate
+        arr = df_ancho[vib_phys_vars].to_numpy(dtype=float, copy=True)
+        antes_na = np.isnan(arr)
+        _interpolar_lineal(arr, IMPUTATION_LIMIT_N)
+        columnas_imputadas.update(zip(vib_phys_vars, arr.T))
+        # Imputada = era NaN antes y ahora tiene un valor
+        banderas.update(zip(vib_phys_vars, (antes_na & ~np.isnan(arr)).T))
 
    # 4. Imputación de Categóricas y Acumulativas
     if cat_acc_vars:
@@ -56,26 +136,25 @@ def impute_by_group(df_ancho: pd.DataFrame) -> pd.DataFrame:
         # 🚨 CORRECCIÓN: Quitamos el bucle de pd.to_numeric aquí también, 
         # ya que la conversión a float se hizo en la fase de detección.
         
-        df_imputado[cat_acc_vars] = df_imputado[cat_acc_vars].ffill(
-            limit=IMPUTATION_LIMIT_N
-        ).bfill(
-            limit=IMPUTATION_LIMIT_N
-        )
+        arr = df_ancho[cat_acc_vars].to_numpy(dtype=float, copy=True)
+        antes_na = np.isnan(arr)
+        _ffill_bfill(arr, IMPUTATION_LIMIT_N)
+        columnas_imputadas.update(zip(cat_acc_vars, arr.T))
+        banderas.update(zip(cat_acc_vars, (antes_na & ~np.isnan(arr)).T))
         # NOTA: Después de la imputación (ffill/bfill), es posible que desees convertir
         # las categóricas y acumulativas a INT de nuevo si no tienen NaNs, pero eso
         # es un paso posterior a la imputación. Por ahora, déjalas como float.
 
-    # 5. Generar la bandera final
-    # Una celda fue imputada si originalmente era NaN Y ahora tiene un valor.
-    # Una celda fue imputada si originalmente era NaN Y ahora tiene un valor.
-    is_imputed_flags = imputation_mask & (~df_imputado.isna())
-    
-    # Renombrar las columnas de la máscara para evitar conflictos y prepararlas para el melt en main.py
-    is_imputed_flags.columns = [f"{col}_is_imputed" for col in is_imputed_flags.columns]
-    
-    # Unir las banderas al DataFrame imputado (se unirán por índice 'ts_utc')
-    df_imputado = pd.concat([df_imputado, is_imputed_flags], axis=1)
+    # 5. Construir el resultado de una vez: columnas imputadas + el resto tal
+    # cual (en el orden original), seguidas de las banderas '<col>_is_imputed'
+    # (nombres distintos para evitar conflictos y prepararlas para el melt en main.py).
+    # El índice es el de df_ancho ('ts_utc').
+    datos = {col: columnas_imputadas.get(col, df_ancho[col]) for col in df_ancho.columns}
+    datos.update(
+        (f"{col}_is_imputed", banderas.get(col, sin_imputar)) for col in df_ancho.columns
+    )
+    df_imputado = pd.DataFrame(datos, index=df_ancho.index, columns=list(datos))
 
     # 🚨 NOTA: Los NaNs restantes en df_imputado SÍ son GAPS GRANDES (>= 2 * 15min)
     
-    return df_imputado
\ No newline at end of file
+    return df_imputado
@@ -1,9 +1,45 @@
 import math
-from typing import Tuple
-from config_api import BASE_CARACTERISTICAS
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import numpy as np
 import pandas as pd
-import requests  # por si necesitas usarlo directamente
-from config_api import API_ROOT, API_PREFIX, session, headers, auth
+import requests
+from config_api import BASE_CARACTERISTICAS, MAX_WORKERS, session, json_headers, json_dumps, auth
+from api_utils import ts_iso_utc, payloads_a_dicts, map_acotado
+
+ITEM_COLS = [
+    "despliegue_id", "ts_utc", "variable", "caracteristica",
+    "valor", "ventana_s", "indicador_calidad",
+]
+
+
+def construir_payloads_caracteristicas(df_feats: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Prepara de una vez todas las columnas del payload de /caracteristicas/bulk
+    (ts_utc en ISO 8601, valor como float o None, enteros como int64).
+    Las filas sin ts_utc se descartan.
+
+    Retorna:
+      (df_payload con ITEM_COLS, posición en df_feats de cada fila de df_payload)
+    """
+    ts_utc = pd.to_datetime(df_feats["ts_utc"])
+    posiciones = np.flatnonzero(ts_utc.notna().to_numpy())
+    df_env = df_feats.iloc[posiciones]
+    ts_utc = ts_utc.iloc[posiciones]
+
+    valor = pd.to_numeric(df_env["valor"], errors="coerce")
+    df_payload = pd.DataFrame({
+        "despliegue_id": df_env["despliegue_id"].astype("int64"),
+        "ts_utc": ts_iso_utc(ts_utc),
+        "variable": df_env["variable"].astype(str),
+        "caracteristica": df_env["caracteristica"].astype(str),
+        # Pydantic / FastAPI lo interpretan como Decimal si es numérico
+        "valor": np.where(valor.notna(), valor.astype(float), None),
+        "ventana_s": df_env["ventana_s"].astype("int64"),
+        "indicador_calidad": df_env["indicador_calidad"].astype("int64"),
+    })
+
+    return df_payload[ITEM_COLS].reset_index(drop=True), posiciones
 
 
 def post_with_bulk(
@@ -49,84 +85,63 @@ def post_with_bulk(
 
     print(f"\n>>> Enviando {total_rows} características en lotes de {batch_size}...")
 
-    # Recorremos el DataFrame en chunks
-    for start in range(0, total_rows, batch_size):
-        end = start + batch_size
-        chunk = df_feats.iloc[start:end]
-
-        items = []
-        for _, row in chunk.iterrows():
-            ts_utc = row["ts_utc"]
-
-            # Aseguramos que ts_utc sea serializable (ISO 8601)
-            if pd.isna(ts_utc):
-                # Si no hay ts_utc, no tiene sentido insertarlo
-                continue
-
-            if hasattr(ts_utc, "isoformat"):
-                ts_str = ts_utc.isoformat()
-            else:
-                # Si por alguna razón no es datetime, intentamos convertir
-                ts_str = pd.to_datetime(ts_utc).isoformat()
-
-            valor = row["valor"]
-            if pd.isna(valor):
-                valor_json = None
-            else:
-                # Pydantic / FastAPI lo interpretan como Decimal si es numérico
-                valor_json = float(valor)
-
-            item = {
-                "despliegue_id": int(row["despliegue_id"]),
-                "ts_utc": ts_str,
-                "variable": str(row["variable"]),
-                "caracteristica": str(row["caracteristica"]),
-                "valor": valor_json,
-                "ventana_s": int(row["ventana_s"]),
-                "indicador_calidad": int(row["indicador_calidad"]),
-            }
-            items.append(item)
-
-        if not items:
-            continue
-
-        payload = {"items": items}
-
-        print(f"POST {url}  (filas {start}–{end-1})  items={len(items)}")
+    # Payloads de todas las filas de una vez (sin iterrows); las filas sin
+    # ts_utc no tiene sentido insertarlas
+    df_payload, posiciones = construir_payloads_caracteristicas(df_feats)
 
+    def enviar_lote(lote: Tuple[int, int, List[dict]]):
+        """POST de un lote. Devuelve (respuesta, mensaje de error)."""
+        start, end, items = lote
         try:
             resp = session.post(
                 url,
-                json=payload,
-                headers=headers,
+                data=json_dumps({"items": items}),
+                headers=json_headers,
                 auth=auth,
                 timeout=timeout,
             )
         except requests.exceptions.Timeout:
-            print(f"❌ Timeout al enviar lote {start}–{end-1}")
-            # puedes decidir si quieres romper aquí o seguir:
-            continue
+            return None, f"❌ Timeout al enviar lote {start}–{end-1}"
         except Exception as e:
-            print(f"❌ Error inesperado en lote {start}–{end-1}: {e}")
-            continue
+            return None, f"❌ Error inesperado en lote {start}–{end-1}: {e}"
+        return resp, None
+
+    # Lotes por rango de filas de df_feats (como antes); los dicts de cada
+    # lote se generan justo antes de enviarlo
+    cortes = np.searchsorted(posiciones, np.arange(0, total_rows + batch_size, batch_size))
+    lotes = (
+        (start, start + batch_size, payloads_a_dicts(df_payload.iloc[desde:hasta]))
+        for start, desde, hasta in zip(range(0, total_rows, batch_size), cortes[:-1], cortes[1:])
+        if hasta > desde
+    )
+
+    # Los POST se solapan en hilos (sesión compartida con pool de conexiones);
+    # las respuestas se procesan en el hilo principal, en orden de lote.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for (start, end, items), (resp, error) in map_acotado(executor, enviar_lote, lotes, 2 * MAX_WORKERS):
+            print(f"POST {url}  (filas {start}–{end-1})  items={len(items)}")
+
+            if error is not None:
+                print(error)
+                continue
 
-        if resp.status_code != 201:
-            print(f"❌ Error HTTP {resp.status_code} en lote {start}–{end-1}: {resp.text}")
-            continue
+            if resp.status_code != 201:
+                print(f"❌ Error HTTP {resp.status_code} en lote {start}–{end-1}: {resp.text}")
+                continue
 
-        try:
-            data = resp.json()
-        except ValueError:
-            print("❌ No se pudo parsear la respuesta JSON del servidor.")
-            continue
+            try:
+                data = resp.json()
+            except ValueError:
+                print("❌ No se pudo parsear la respuesta JSON del servidor.")
+                continue
 
-        inserted = data.get("inserted", 0)
-        skipped = data.get("skipped", 0)
+            inserted = data.get("inserted", 0)
+            skipped = data.get("skipped", 0)
 
-        total_inserted += inserted
-        total_skipped += skipped
+            total_inserted += inserted
+            total_skipped += skipped
 
-        print(f"   ✓ inserted={inserted}, skipped={skipped}")
+            print(f"   ✓ inserted={inserted}, skipped={skipped}")
 
     print(f"\n>>> RESUMEN ENVÍO CARACTERÍSTICAS")
     print(f"   Total filas en df_feats: {total_rows}")
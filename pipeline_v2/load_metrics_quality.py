@@ -1,12 +1,37 @@
+import math
+import random
+import threading
 import time
-from typing import Optional, Iterable, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Iterable, List, Tuple
+import numpy as np
 import pandas as pd
 import requests
-from config_api import session, headers, auth, BASE_MEDICIONES
+from config_api import session, json_headers, json_dumps, auth, BASE_MEDICIONES, MAX_WORKERS
+from api_utils import ts_iso_utc, payloads_a_dicts, map_acotado
 
 # Timeout: (connect_timeout, read_timeout)
 TIMEOUT = (5, 120)
 MAX_RETRIES = 5
+# Backoff exponencial con jitter entre reintentos (segundos): evita esperas
+# largas innecesarias y que los hilos reintenten todos a la vez
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+BACKOFF_JITTER = 0.5
+
+# Tamaño de lote para /mediciones/bulk
+BULK_SIZE = 1000
+# Respuestas del bulk ante las que se reenvía el lote fila a fila
+# (lote demasiado grande / no validable / endpoint bulk no disponible)
+BULK_FALLBACK_STATUS = (404, 405, 413, 422)
+# De ellas, las que indican que el servidor no tiene endpoint bulk: tras la
+# primera, el resto de lotes se envía directamente fila a fila
+BULK_NO_DISPONIBLE_STATUS = (404, 405)
+
+
+def _espera_reintento(attempt: int) -> float:
+    """Segundos a esperar antes del reintento número `attempt` (1, 2, 3...)."""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) + random.uniform(0, BACKOFF_JITTER)
 
 
 def post_with_retry(payload: dict) -> Tuple[bool, Optional[int]]:
@@ -22,8 +47,8 @@ def post_with_retry(payload: dict) -> Tuple[bool, Optional[int]]:
         try:
             r = session.post(
                 url,
-                json=payload,
-                headers=headers,
+                data=json_dumps(payload),
+                headers=json_headers,
                 auth=auth,
                 timeout=TIMEOUT,
             )
@@ -33,8 +58,8 @@ def post_with_retry(payload: dict) -> Tuple[bool, Optional[int]]:
                 return True, r.status_code
 
             # Caso conflicto por duplicado: lo tratamos como "ok lógico"
+            # (sin log por fila: se contabiliza en el resumen de la carga)
             if r.status_code == 409:
-                print(f"⚠ Medición duplicada (409). Se omite pero se considera OK lógico.")
                 return True, r.status_code
 
             # Otros errores HTTP
@@ -45,8 +70,10 @@ def post_with_retry(payload: dict) -> Tuple[bool, Optional[int]]:
             print(f"💥 Error de conexión en intento {attempt}: {e}")
 
         # Si llegó aquí, reintentamos
-        sleep_time = 2 * attempt
-        print(f"⏳ Reintentando en {sleep_time} segundos...")
+        if attempt == MAX_RETRIES:
+            break  # sin espera tras el último intento
+        sleep_time = _espera_reintento(attempt)
+        print(f"⏳ Reintentando en {sleep_time:.1f} segundos...")
         time.sleep(sleep_time)
 
     # Si se agotaron los reintentos:
@@ -54,12 +81,146 @@ def post_with_retry(payload: dict) -> Tuple[bool, Optional[int]]:
     return False, None
 
 
+def post_bulk_with_retry(items: List[dict]) -> Tuple[bool, Optional[int], dict]:
+    """
+    Envía un lote de mediciones al endpoint /mediciones/bulk con reintentos.
+
+    Retorna:
+      (ok, status_code, respuesta_json)
+      Si el servidor rechaza el lote (413/422/404/405) no se reintenta:
+      el llamador decide si reenviar fila a fila.
+    """
+    url = f"{BASE_MEDICIONES}/bulk"
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            r = session.post(
+                url,
+                data=json_dumps({"items": items}),
+                headers=json_headers,
+                auth=auth,
+                timeout=TIMEOUT,
+            )
+
+            if r.status_code in (200, 201):
+                try:
+                    return True, r.status_code, r.json()
+                except ValueError:
+                    return True, r.status_code, {}
+
+            if r.status_code in BULK_FALLBACK_STATUS:
+                return False, r.status_code, {}
+
+            print(f"⚠ Error HTTP {r.status_code} en lote: {r.text}")
+        except requests.exceptions.ReadTimeout:
+            print(f"⏳ ReadTimeout en intento {attempt} (lote)")
+        except requests.exceptions.ConnectionError as e:
+            print(f"💥 Error de conexión en intento {attempt} (lote): {e}")
+
+        if attempt == MAX_RETRIES:
+            break  # sin espera tras el último intento
+        sleep_time = _espera_reintento(attempt)
+        print(f"⏳ Reintentando lote en {sleep_time:.1f} segundos...")
+        time.sleep(sleep_time)
+
+    print("❌ Lote falló definitivamente después de varios intentos.")
+    return False, None, {}
+
+
+PAYLOAD_COLS = ["despliegue_id", "ts_utc", "variable", "valor", "indicador_calidad"]
+
+
+def construir_payloads_mediciones(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Prepara de una vez todas las columnas del payload de /mediciones:
+      - despliegue_id / indicador_calidad (quality_code) como int64
+      - ts_utc en ISO 8601 UTC (filas sin ts_utc se descartan)
+      - valor como float o None (NaN -> null en JSON)
+
+    Devuelve un DataFrame con PAYLOAD_COLS listo para payloads_a_dicts.
+    """
+    if "despliegue_id" not in df.columns:
+        raise KeyError("El DataFrame debe tener la columna 'despliegue_id'.")
+
+    # Solo las columnas del payload: el filtro de NaT no copia el resto
+    # (flags de limpieza, etc.) de df_limpio
+    cols = [c for c in ("despliegue_id", "ts_utc", "variable", "valor", "quality_code") if c in df.columns]
+    df_env = df[cols]
+    ts_utc = pd.to_datetime(df_env["ts_utc"])
+    con_ts = ts_utc.notna()
+    if not con_ts.all():
+        df_env = df_env[con_ts.to_numpy()]
+        ts_utc = ts_utc[con_ts]
+
+    try:
+        despliegue_ids = df_env["despliegue_id"].astype("int64")
+    except (ValueError, TypeError):
+        raise ValueError(f"Valores inválidos de despliegue_id: {df_env['despliegue_id'].unique()[:5]}")
+
+    if "valor" in df_env.columns:
+        valor = pd.to_numeric(df_env["valor"], errors="coerce")
+    else:
+        valor = pd.Series(np.nan, index=df_env.index)
+
+    df_payload = pd.DataFrame({
+        "despliegue_id": despliegue_ids,
+        "ts_utc": ts_iso_utc(ts_utc),
+        "variable": df_env["variable"].astype(str),
+        "valor": np.where(valor.notna(), valor.astype(float), None),
+        "quality_code": df_env["quality_code"].astype("int64") if "quality_code" in df_env.columns else 0,
+    })
+
+    return df_payload.rename(columns={"quality_code": "indicador_calidad"})[PAYLOAD_COLS].reset_index(drop=True)
+
+
+def _contabilizar_lote(
+    executor: ThreadPoolExecutor,
+    items: List[dict],
+    ok: bool,
+    status: Optional[int],
+    data: dict,
+) -> Tuple[int, int, int]:
+    """
+    Traduce el resultado de un lote a (insertadas, duplicadas, fallidas).
+    Si el servidor rechazó el lote, lo reenvía fila a fila en el executor.
+    """
+    if ok:
+        inserted = int(data.get("inserted", len(items)))
+        skipped = int(data.get("skipped", len(items) - inserted))
+        return inserted, skipped, 0
+
+    if status not in BULK_FALLBACK_STATUS:
+        print(f"❌ Error al enviar lote de {len(items)} mediciones (status={status})")
+        return 0, 0, len(items)
+
+    # El servidor rechaza el lote: reenviamos fila a fila
+    print(f"⚠ Lote rechazado ({status}). Reintentando fila a fila...")
+    insertadas = duplicadas = fallidas = 0
+    ejemplos = []  # unas pocas filas fallidas para el log (no una línea por fila)
+    for item, (ok_row, status_row) in zip(items, executor.map(post_with_retry, items)):
+        if ok_row:
+            if status_row == 409:
+                duplicadas += 1
+            else:
+                insertadas += 1
+        else:
+            fallidas += 1
+            if len(ejemplos) < 3:
+                ejemplos.append(f"(ts_utc={item['ts_utc']}, variable={item['variable']})")
+
+    if fallidas:
+        print(f"❌ {fallidas} de {len(items)} mediciones del lote fallaron, p. ej.: {', '.join(ejemplos)}")
+
+    return insertadas, duplicadas, fallidas
+
+
 def guardar_mediciones(
     df_limpio: pd.DataFrame,
     quality_filter: Optional[Iterable[int]] = None,
 ) -> Tuple[int, int, int]:
     """
-    Envía mediciones limpias a la API /api/mediciones.
+    Envía mediciones limpias a la API /api/mediciones, en lotes de BULK_SIZE
+    vía /mediciones/bulk (con reenvío fila a fila si el lote es rechazado).
 
     Parámetros:
       df_limpio:
@@ -85,15 +246,23 @@ def guardar_mediciones(
     # Aplicar filtro de calidad
     # ------------------------------
     if quality_filter is None:
-        df_a_guardar = df_limpio.copy()
+        # Sin copia: los payloads se construyen sin modificar df_limpio
+        df_a_guardar = df_limpio
         print(f"→ Guardando TODAS las {len(df_a_guardar)} mediciones procesadas")
     else:
-        df_a_guardar = df_limpio[df_limpio["quality_code"].isin(quality_filter)]
+        # Máscara directamente en NumPy (el filtro suele tener 1-2 códigos)
+        quality_filter = list(quality_filter)
+        codes = df_limpio["quality_code"].to_numpy()
+        if len(quality_filter) == 1:
+            mask = codes == quality_filter[0]
+        else:
+            mask = np.isin(codes, quality_filter)
+        df_a_guardar = df_limpio[mask]
         if df_a_guardar.empty:
             print("No hay mediciones que cumplan el filtro de quality_code.")
             return 0, 0, 0
         print(
-            f"→ Guardando {len(df_a_guardar)} mediciones con quality_code en {list(quality_filter)} "
+            f"→ Guardando {len(df_a_guardar)} mediciones con quality_code en {quality_filter} "
             f"de un total de {len(df_limpio)}."
         )
 
@@ -105,56 +274,56 @@ def guardar_mediciones(
     print(f"\n=== INICIO DE CARGA A /api/mediciones ===\n")
     print(f"Total de filas a enviar: {total}\n")
 
-    for idx, row in df_a_guardar.reset_index(drop=True).iterrows():
-        # Construir payload para la API
-        try:
-            despliegue_id = int(row["despliegue_id"])
-        except KeyError:
-            raise KeyError("El DataFrame debe tener la columna 'despliegue_id'.")
-        except ValueError:
-            raise ValueError(f"Valor inválido de despliegue_id en fila {idx}: {row['despliegue_id']}")
-
-        ts_utc = row["ts_utc"]
-        if pd.isna(ts_utc):
-            # Si no hay timestamp, no tiene sentido enviarla
-            print(f"⚠ Fila {idx}: ts_utc es NaN. Se omite.")
-            fallidas += 1
-            continue
-
-        if not hasattr(ts_utc, "isoformat"):
-            # Aseguramos que sea datetime
-            ts_utc = pd.to_datetime(ts_utc)
+    # ------------------------------
+    # Payloads (vectorizado, sin bucle por fila)
+    # ------------------------------
+    df_payload = construir_payloads_mediciones(df_a_guardar)
 
-        valor = row.get("valor", None)
-        if pd.isna(valor):
-            valor_json = None
-        else:
-            valor_json = float(valor)
+    # Si no hay timestamp, no tiene sentido enviarla
+    n_sin_ts = total - len(df_payload)
+    if n_sin_ts:
+        print(f"⚠ {n_sin_ts} filas con ts_utc NaN. Se omiten.")
+        fallidas += n_sin_ts
 
-        quality_code = int(row.get("quality_code", 0))
+    # ------------------------------
+    # Envío por lotes a /mediciones/bulk
+    # ------------------------------
+    # Los dicts de cada lote se generan justo antes de enviarlo (no todos de
+    # golpe) y hay como mucho 2 * MAX_WORKERS lotes en vuelo: la memoria de
+    # payloads queda acotada aunque el despliegue tenga millones de filas.
+    n_lotes = max(1, math.ceil(len(df_payload) / BULK_SIZE))
+    lotes = (
+        payloads_a_dicts(df_payload.iloc[lote[0]:lote[-1] + 1])
+        for lote in np.array_split(np.arange(len(df_payload)), n_lotes)
+        if lote.size
+    )
+    enviadas = 0
 
-        payload = {
-            "despliegue_id": despliegue_id,
-            "ts_utc": ts_utc.isoformat(),
-            "variable": str(row["variable"]),
-            "valor": valor_json,
-            "indicador_calidad": quality_code,
-        }
+    # Si /bulk no existe en el servidor, no se vuelve a probar en cada lote
+    sin_bulk = threading.Event()
 
-        ok, status = post_with_retry(payload)
+    def enviar_lote(items: List[dict]) -> Tuple[bool, Optional[int], dict]:
+        if sin_bulk.is_set():
+            return False, BULK_NO_DISPONIBLE_STATUS[0], {}
+        ok, status, data = post_bulk_with_retry(items)
+        if status in BULK_NO_DISPONIBLE_STATUS and not sin_bulk.is_set():
+            sin_bulk.set()
+            print(f"⚠ /mediciones/bulk no disponible ({status}). El resto de lotes se envía fila a fila.")
+        return ok, status, data
 
-        if ok:
-            if status == 409:
-                duplicadas_o_skipped += 1
-            else:
-                insertadas_ok += 1
-        else:
-            fallidas += 1
-            print(f"❌ Error al enviar medición idx={idx} (ts_utc={ts_utc}, variable={row['variable']})")
+    # Los POST se solapan en hilos (la sesión es segura para POST simples);
+    # los resultados se agregan en el hilo principal, en orden.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        resultados = map_acotado(executor, enviar_lote, lotes, 2 * MAX_WORKERS)
+        for items, (ok, status, data) in resultados:
+            insertadas, duplicadas, fallos = _contabilizar_lote(executor, items, ok, status, data)
+            insertadas_ok += insertadas
+            duplicadas_o_skipped += duplicadas
+            fallidas += fallos
 
-        # Log simple de progreso
-        if (idx + 1) % 500 == 0:
-            print(f"   → Progreso: {idx + 1}/{total} filas procesadas...")
+            # Log simple de progreso
+            enviadas += len(items)
+            print(f"   → Progreso: {enviadas}/{total} filas procesadas...")
 
     print("\n=== RESUMEN CARGA MEDICIONES ===")
     print(f"Insertadas OK.............: {insertadas_ok}")
@@ -86,9 +86,11 @@ def main():
     total_quality_rows = len(df_auditoria)
 
     print("\n--- RESUMEN DE BANDERAS DETECTADAS ---\n")
+    # Una sola reducción para todas las banderas presentes
+    flag_sums = df_quality[[c for c in flag_cols if c in df_quality.columns]].sum()
     for col in flag_cols:
-        if col in df_quality.columns:
-            n = int(df_quality[col].sum())
+        if col in flag_sums.index:
+            n = int(flag_sums[col])
             perc = (n / total_quality_rows) * 100 if total_quality_rows > 0 else 0
             print(f"  {col:<25}: {n} filas ({perc:.2f} %)")
         else:
@@ -106,6 +108,9 @@ def main():
     # 2) Visualización detallada de calidad
     pausar_y_continuar("\nPresione ENTER para VER DETALLE de datos con CALIDAD NO-OK (Códigos > 0)...")
     
+    # Posiciones de filas por código, calculadas una vez (sin re-escanear
+    # df_quality en cada consulta del bucle interactivo)
+    posiciones_por_codigo = df_quality.groupby("quality_code", sort=True).indices
     codigos_disponibles = list(quality_counts[quality_counts.index > 0].index)
     if not codigos_disponibles:
         print("\nTodos los datos marcados son de Calidad OK (Código 0).")
@@ -121,9 +126,9 @@ def main():
                     label = QUALITY_LABELS.get(target_code, "Desconocido")
                     
                     print(f"\n=== MUESTRA DE DATOS CON INDICADOR DE CALIDAD {target_code} ({label}) ===\n")
-                    df_sample = df_quality[df_quality["quality_code"] == target_code][
+                    df_sample = df_quality.iloc[posiciones_por_codigo[target_code][:10]][
                         ["ts_utc", "variable", "valor", "quality_code"] + [c for c in flag_cols if c in df_quality.columns]
-                    ].head(10)
+                    ]
                     print(df_sample)
                 else:
                     print(f" El código '{user_input}' no está disponible o no tiene registros.")